@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Generate a synthetic mkdocs-library project for benchmarking.
+
+The project has a main book and books - 1 sub books, each with
+the given number of pages (Markdown files), a navigation nested
+to the given depth, and a search index in the site directory
+as if the books had been built. Example:
+
+    python benchmarks/library.py /tmp/library --books 50 --pages 200 --tabs
+"""
+
+import argparse
+import json
+import os
+
+import oyaml
+
+
+TEMPLATE = """site_description: Synthetic library for benchmarks
+repo_url: https://example.com/library
+edit_uri: edit/master/<<<src_dir>>>/docs/
+theme:
+  name: material
+  feature:
+    tabs: {tabs}
+plugins:
+  - search
+use_directory_urls: false
+"""
+
+
+def book_names(books):
+    """The names of the generated books, main book first."""
+    return ['main'] + ['book{:03}'.format(i) for i in range(1, books)]
+
+
+def _nav(pages, depth, prefix=''):
+    """Return a navigation list for the pages, nested in sections
+    up to the given depth (depth 1 is a flat list).
+    """
+    if depth <= 1 or len(pages) <= 1:
+        return [{'Page {}'.format(page): page} for page in pages]
+    # Split the pages into (at most) four sections
+    size = -(-len(pages) // 4)
+    return [
+        {
+            'Section {}{}'.format(prefix, i + 1): _nav(
+                pages[start:start + size],
+                depth - 1,
+                '{}{}.'.format(prefix, i + 1)
+            )
+        }
+        for i, start in enumerate(range(0, len(pages), size))
+    ]
+
+
+def generate_library(
+    root,
+    books=10,
+    pages=20,
+    nav_depth=2,
+    tabs=False,
+    docs=None,
+    text_length=200
+):
+    """Generate a project in root (which must not exist yet).
+    'docs' is the number of entries in each book's search index,
+    defaulting to five per page (MkDocs adds entries for sections).
+    """
+    if docs is None:
+        docs = pages * 5
+    config_dir = os.path.join(root, '_config')
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, 'template.yml'), 'w') as f:
+        f.write(TEMPLATE.format(tabs='true' if tabs else 'false'))
+    with open(os.path.join(config_dir, 'defaults.yml'), 'w') as f:
+        f.write('book_name: "Untitled book"\n')
+
+    for name in book_names(books):
+        book_dir = os.path.join(root, 'books', name)
+        os.makedirs(os.path.join(book_dir, '_config'))
+        os.makedirs(os.path.join(book_dir, 'docs'))
+        with open(os.path.join(book_dir, '_config', 'book-config.yml'), 'w') as f:
+            f.write('book_name: "Book {}"\n'.format(name))
+        page_files = ['page{:04}.md'.format(i) for i in range(pages)]
+        nav = [{'Home': 'index.md'}] + _nav(page_files, nav_depth)
+        with open(os.path.join(book_dir, '_config', 'navigation.yml'), 'w') as f:
+            f.write(oyaml.safe_dump(nav, default_flow_style=False))
+        for page in ['index.md'] + page_files:
+            with open(os.path.join(book_dir, 'docs', page), 'w') as f:
+                f.write('# {} {}\n\nSome text.\n'.format(name, page))
+
+        segment = '' if name == 'main' else name
+        search_dir = os.path.join(root, 'site', segment, 'search')
+        os.makedirs(search_dir, exist_ok=True)
+        index = {
+            'config': {
+                'lang': ['en'],
+                'separator': '[\\s\\-]+'
+            },
+            'docs': [
+                {
+                    'location': 'page{:04}.html#section-{}'.format(i // 5, i % 5),
+                    'text': ('{} {} '.format(name, i) * text_length)[:text_length],
+                    'title': 'Section {} of {}'.format(i, name)
+                }
+                for i in range(docs)
+            ]
+        }
+        with open(os.path.join(search_dir, 'search_index.json'), 'w') as f:
+            json.dump(index, f)
+
+
+def add_arguments(parser):
+    """Add the generator's options to an argument parser."""
+    parser.add_argument(
+        '--books',
+        type=int,
+        default=10,
+        help='Number of books (including the main book), defaults to 10'
+    )
+    parser.add_argument(
+        '--pages',
+        type=int,
+        default=20,
+        help='Number of pages per book, defaults to 20'
+    )
+    parser.add_argument(
+        '--nav-depth',
+        type=int,
+        default=2,
+        help='Nesting depth of the navigation, defaults to 2'
+    )
+    parser.add_argument(
+        '--tabs',
+        action='store_true',
+        help='Use the tabs layout of the Material theme'
+    )
+    parser.add_argument(
+        '--docs',
+        type=int,
+        help='Number of entries in each search index, '
+             'defaults to five per page'
+    )
+    parser.add_argument(
+        '--text',
+        type=int,
+        default=200,
+        help='Length of each search index entry\'s text, defaults to 200'
+    )
+
+
+def library_options(args):
+    """The generate_library() keyword arguments from parsed arguments."""
+    return {
+        'books': args.books,
+        'pages': args.pages,
+        'nav_depth': args.nav_depth,
+        'tabs': args.tabs,
+        'docs': args.docs,
+        'text_length': args.text
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('root', help='Directory to create the project in')
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate_library(args.root, **library_options(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Measure how merging the search indexes scales with the number of books.
+
+A synthetic project with the given numbers of books and docs per book
+is generated in a temporary directory (see library.py, the books are
+not built), then the 'merge-indexes' task is timed. Example:
+
+    python benchmarks/merge_indexes.py --books 5,10,20,50 --docs 5000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+
+from library import generate_library
+from mkdocs_library.main import parse_args, program_defaults_dir
+from mkdocs_library.project import Project
+
+
+def run(root):
+    """Merge the indexes of the project in root, return the elapsed time."""
+    project = Project(
+        parse_args(['--root', root, '--recipe', 'merge-indexes']),
+        program_defaults_dir()
+    )
+    stdout = sys.stdout
+    try:
+        # Don't mix the task's progress output into the table
+        sys.stdout = open(os.devnull, 'w')
+        start = time.perf_counter()
+        project.task_merge_indexes()
+        return time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--books',
+        default='5,10,20',
+        help='Comma separated list of book counts, defaults to "5,10,20"'
+    )
+    parser.add_argument(
+        '--docs',
+        type=int,
+        default=1000,
+        help='Number of docs per book, defaults to 1000'
+    )
+    parser.add_argument(
+        '--text',
+        type=int,
+        default=200,
+        help='Length of each doc\'s text, defaults to 200'
+    )
+    args = parser.parse_args()
+
+    print('{:>6} {:>8} {:>10} {:>12}'.format('books', 'docs', 'seconds', 'ms/book²'))
+    for books in [int(n) for n in args.books.split(',')]:
+        root = tempfile.mkdtemp(prefix='mkdocs-library-bench-')
+        shutil.rmtree(root)
+        try:
+            generate_library(
+                root,
+                books=books,
+                pages=1,
+                docs=args.docs,
+                text_length=args.text
+            )
+            elapsed = run(root)
+        finally:
+            shutil.rmtree(root)
+        print('{:>6} {:>8} {:>10.3f} {:>12.3f}'.format(
+            books, args.docs, elapsed, elapsed * 1000 / books ** 2
+        ))
+
+
+if __name__ == '__main__':
+    main()
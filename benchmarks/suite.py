@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Benchmark the phases of mkdocs-library on a synthetic library.
+
+A project is generated (see library.py) and each phase is run on a fresh
+copy of it, once for the wall time and once (with tracemalloc) for the
+peak memory. The results can be written to a JSON file, and two such
+files (e.g. from two commits) can be compared. Examples:
+
+    python benchmarks/suite.py --books 50 --pages 100 --output new.json
+    python benchmarks/suite.py --compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+
+from library import add_arguments, generate_library, library_options
+from mkdocs_library.main import parse_args, program_defaults_dir
+from mkdocs_library.project import Project
+
+
+def _project(root):
+    """A fresh project object for the library in root."""
+    return Project(
+        parse_args(['--root', root, '--force']),
+        program_defaults_dir()
+    )
+
+
+# Each phase is a pair of functions: a setup function that is
+# called with the project root and returns the arguments for the
+# measured function, which is called with these arguments.
+
+def _setup_project(root):
+    return [_project(root)]
+
+
+def _setup_nav(root):
+    project = _project(root)
+    for book in project.books():
+        book.update_template()
+        book.nav()
+    return [project]
+
+
+def _update_nav(project):
+    for book in project.books():
+        project.update_nav(book)
+
+
+def _setup_indexes(root):
+    project = _project(root)
+    for book in project.books():
+        book.store_original_index()
+    return [project, [book.search_index() for book in project.books()]]
+
+
+def _setup_loaded_indexes(root):
+    project, indexes = _setup_indexes(root)
+    for index in indexes:
+        index.load()
+    return [project, indexes]
+
+
+def _parse_indexes(project, indexes):
+    for index in indexes:
+        index.load()
+
+
+def _update_indexes(project, indexes):
+    for index in indexes:
+        index.update(project.books())
+
+
+def _write_indexes(project, indexes):
+    for index in indexes:
+        index.write_merged(project.books())
+
+
+PHASES = [
+    ('merge_sources', _setup_project, lambda p: p.task_merge_sources()),
+    ('update_nav', _setup_nav, _update_nav),
+    ('index_parse', _setup_indexes, _parse_indexes),
+    ('index_update', _setup_loaded_indexes, _update_indexes),
+    ('index_write', _setup_loaded_indexes, _write_indexes),
+    ('merge_indexes', _setup_project, lambda p: p.task_merge_indexes()),
+]
+
+
+def measure(template_root, setup, func, memory=False):
+    """Run a phase on a copy of the generated project.
+    Returns the elapsed seconds, or the peak of traced memory in bytes.
+    """
+    root = tempfile.mkdtemp(prefix='mkdocs-library-bench-')
+    shutil.rmtree(root)
+    shutil.copytree(template_root, root)
+    stdout = sys.stdout
+    try:
+        args = setup(root)
+        # Don't measure the tasks' progress output
+        sys.stdout = open(os.devnull, 'w')
+        if memory:
+            tracemalloc.start()
+            func(*args)
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            func(*args)
+            result = time.perf_counter() - start
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        shutil.rmtree(root)
+    return result
+
+
+def commit():
+    """The current git commit of the working tree, if available."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options, phases=None, repeat=1):
+    """Generate a library with the given options and measure
+    the (given) phases. The best time of 'repeat' runs is reported.
+    """
+    template_root = tempfile.mkdtemp(prefix='mkdocs-library-bench-')
+    shutil.rmtree(template_root)
+    results = {}
+    try:
+        generate_library(template_root, **options)
+        for name, setup, func in PHASES:
+            if phases and not name in phases:
+                continue
+            results[name] = {
+                'seconds': min(
+                    measure(template_root, setup, func)
+                    for _ in range(repeat)
+                ),
+                'peak_memory': measure(template_root, setup, func, memory=True)
+            }
+            print('{:<16} {:>10.3f} s {:>10.1f} MB'.format(
+                name,
+                results[name]['seconds'],
+                results[name]['peak_memory'] / 2 ** 20
+            ))
+    finally:
+        shutil.rmtree(template_root, ignore_errors=True)
+    return {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'options': options,
+        'results': results
+    }
+
+
+def compare(old_file, new_file):
+    """Print a comparison of two result files."""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    if old['options'] != new['options']:
+        print('WARNING: The results were measured with different options')
+    print('{:<16} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}'.format(
+        'phase', 'old s', 'new s', 'ratio', 'old MB', 'new MB', 'ratio'
+    ))
+    for name, result in new['results'].items():
+        if not name in old['results']:
+            continue
+        before = old['results'][name]
+        print('{:<16} {:>10.3f} {:>10.3f} {:>8.2f} {:>10.1f} {:>10.1f} {:>8.2f}'.format(
+            name,
+            before['seconds'],
+            result['seconds'],
+            result['seconds'] / before['seconds'] if before['seconds'] else 0,
+            before['peak_memory'] / 2 ** 20,
+            result['peak_memory'] / 2 ** 20,
+            (
+                result['peak_memory'] / before['peak_memory']
+                if before['peak_memory'] else 0
+            )
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    add_arguments(parser)
+    parser.add_argument(
+        '--phases',
+        help='Comma separated list of phases to run, defaults to all ({})'.format(
+            ', '.join(name for name, _, _ in PHASES)
+        )
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Number of timed runs per phase (the best is reported)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Write the results to this JSON file'
+    )
+    parser.add_argument(
+        '--compare',
+        nargs=2,
+        metavar=('OLD', 'NEW'),
+        help='Compare two result files instead of running the benchmarks'
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = run(
+        library_options(args),
+        phases=args.phases.split(',') if args.phases else None,
+        repeat=args.repeat
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
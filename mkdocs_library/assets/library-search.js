@@ -0,0 +1,124 @@
+/*
+ * This file is part of the mkdocs-library project,
+ * https://github.com/uliska/mkdocs-library
+ *
+ * Copyright (c) 2020 by Urs Liska
+ * Licensed under the GNU General Public License, version 3 or later.
+ *
+ * Loader for sharded mkdocs-library search indexes.
+ *
+ * With the 'sharded' index mode each book's search/search_index.json
+ * references a manifest (search/shards.json at the site root) that lists
+ * one content-hashed shard per book. This loader fetches the shard of
+ * the current book first and the sibling books' shards only when
+ * they are actually needed (i.e. when searching across books).
+ *
+ * Usage (base_url is the current book's root, as in MkDocs templates):
+ *
+ *     var search = new MkDocsLibrarySearch(base_url);
+ *     search.loadLocal().then(function (docs) { ... });
+ *     search.loadAll().then(function (docs) { ... });
+ *
+ * Both return lists of {location, title, text} objects with locations
+ * relative to the current book's root, like MkDocs' own search index.
+ */
+
+(function (global) {
+    'use strict';
+
+    function join(base, path) {
+        if (!base || base === '.') {
+            return path;
+        }
+        return base.replace(/\/+$/, '') + '/' + path;
+    }
+
+    function fetchJSON(url) {
+        return fetch(url).then(function (response) {
+            if (!response.ok) {
+                throw new Error('Could not load ' + url);
+            }
+            return response.json();
+        });
+    }
+
+    function MkDocsLibrarySearch(baseUrl) {
+        this.baseUrl = baseUrl || '.';
+        this.index = null;
+        this.manifest = null;
+        this.shards = {};
+    }
+
+    MkDocsLibrarySearch.prototype.loadManifest = function () {
+        var self = this;
+        if (self.manifest) {
+            return Promise.resolve(self.manifest);
+        }
+        return fetchJSON(join(self.baseUrl, 'search/search_index.json'))
+            .then(function (index) {
+                self.index = index;
+                return fetchJSON(join(self.baseUrl, index.shards));
+            })
+            .then(function (manifest) {
+                self.manifest = manifest;
+                return manifest;
+            });
+    };
+
+    MkDocsLibrarySearch.prototype.loadShard = function (shard) {
+        var self = this;
+        if (!self.shards[shard.file]) {
+            var url = join(self.baseUrl, self.index.location_prefix + shard.file);
+            self.shards[shard.file] = fetchJSON(url).then(function (data) {
+                return self.relativeDocs(data.docs);
+            });
+        }
+        return self.shards[shard.file];
+    };
+
+    // Make the root-relative locations of a shard relative to the
+    // current book (locations within the current book lose their prefix).
+    MkDocsLibrarySearch.prototype.relativeDocs = function (docs) {
+        var prefix = this.index.location_prefix;
+        var own = this.localShard().prefix;
+        return docs.map(function (doc) {
+            var location = doc.location;
+            if (own && location.indexOf(own) === 0) {
+                location = location.slice(own.length);
+            } else {
+                location = prefix + location;
+            }
+            return {location: location, title: doc.title, text: doc.text};
+        });
+    };
+
+    MkDocsLibrarySearch.prototype.localShard = function () {
+        var shards = this.manifest.shards;
+        for (var i = 0; i < shards.length; i++) {
+            if (shards[i].book === this.index.book) {
+                return shards[i];
+            }
+        }
+        return shards[0];
+    };
+
+    MkDocsLibrarySearch.prototype.loadLocal = function () {
+        var self = this;
+        return self.loadManifest().then(function () {
+            return self.loadShard(self.localShard());
+        });
+    };
+
+    MkDocsLibrarySearch.prototype.loadAll = function () {
+        var self = this;
+        return self.loadManifest().then(function (manifest) {
+            return Promise.all(manifest.shards.map(function (shard) {
+                return self.loadShard(shard);
+            }));
+        }).then(function (lists) {
+            return [].concat.apply([], lists);
+        });
+    };
+
+    global.MkDocsLibrarySearch = MkDocsLibrarySearch;
+})(this);
@@ -26,12 +26,24 @@ Implement books as parts of a multi-book documentation site.
 """
 
 
+import logging
 import os
-import oyaml
+import shutil
+import time
 
-from subprocess import Popen
+from subprocess import (
+    Popen,
+    PIPE,
+    STDOUT
+)
 
+from .revisions import REVISION_DATES_FILE, replace_revision_plugin
+from .siblings import SIBLINGS_JSON
 from .util import (
+    hash_file,
+    hash_tree,
+    new_hash,
+    load_yaml,
     read_yaml,
     missing_file,
     serialize_yaml
@@ -45,6 +57,31 @@ MKDOCS_HEADER_COMMENT = """### This book configuration file is generated by mkdo
 """
 
 
+def _setup_mkdocs_logging():
+    """Make MkDocs' log messages visible when it is run in-process.
+    (When MkDocs is run as a command its CLI takes care of that.)
+    """
+    logger = logging.getLogger('mkdocs')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(levelname)-7s -  %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+class BuildError(Exception):
+    """Raised when MkDocs fails to build a book.
+    Carries the book and the (captured) MkDocs output, if any.
+    """
+
+    def __init__(self, book, output=None):
+        super().__init__(
+            "MkDocs failed to build book '{}'".format(book.name())
+        )
+        self.book = book
+        self.output = output
+
+
 class AbstractBook(object):
     """Represents a book.
     Books are part of a mkdocs-library multi-book site.
@@ -64,54 +101,131 @@ class AbstractBook(object):
             'mkdocs.yml'
         )
         self._site_root = os.path.join(
-            project.root(),
-            project.config('site_root'),
+            project.site_directory(),
             self.site_segment()
         )
         config_dir = os.path.join(
             root,
             '_config'
         )
-        config_file = os.path.join(
+        self._config_file = config_file = os.path.join(
             config_dir,
             'book-config.yml'
         )
-        nav_file = os.path.join(
+        self._nav_file = nav_file = os.path.join(
             config_dir,
             'navigation.yml'
         )
         if not os.path.exists(nav_file):
             missing_file(self._name)
-        self._config = read_yaml(config_file)
-        self._config['src_dir'] = 'books/{}'.format(self._name)
         self._common = ''
-    # TODO:
-    # https://github.com/uliska/mkdocs-library/issues/1
-        self._nav = {
-            'nav': read_yaml(nav_file)
-        }
+        # The configuration and navigation files are read upon first request
+        self._config = None
+        self._nav = None
         self._search_index = None
         self._built = False
+        self._build_time = None
 
     def book_config(self, key):
         """Returns a configuration variable on book level,
         or None, if not defined.
         Should only be called from Project.config().
         """
+        if self._config is None:
+            self._read_config()
         return self._config.get(key, None)
 
-    def build(self):
-        """Call MkDocs to build the book."""
+    def build(self, capture=False):
+        """Call MkDocs to build the book,
+        using the project's configured build engine.
+        Raises a BuildError if MkDocs exits with an error.
+        """
+        with self.project().profiler().span('build', self):
+            if self.project().build_engine() == 'inprocess':
+                return self.build_inprocess()
+            return self.build_subprocess(capture)
+
+    def build_inprocess(self):
+        """Build the book through MkDocs' Python API.
+        This runs in the current interpreter, so everything imported
+        for the first book (MkDocs, plugins, themes, Jinja) is reused
+        by the following books.
+        Prints the time spent for startup (imports and loading the
+        configuration, plugins and theme) and for the actual build.
+        """
+        print("Building partial book", self.name(), "(in-process)")
+        start = time.perf_counter()
+        from mkdocs.commands.build import build
+        from mkdocs.config import load_config
+        from mkdocs.exceptions import MkDocsException
+        _setup_mkdocs_logging()
+
+        config_file = os.path.abspath(self.target_file())
+        cwd = os.getcwd()
+        os.chdir(self.src_root())
+        try:
+            config = load_config(config_file=config_file)
+            plugins = config['plugins']
+            if hasattr(plugins, 'on_startup'):
+                plugins.on_startup(command='build', dirty=False)
+            started = time.perf_counter()
+            try:
+                build(config)
+            finally:
+                if hasattr(plugins, 'on_shutdown'):
+                    plugins.on_shutdown()
+        except MkDocsException as e:
+            raise BuildError(self, str(e)) from e
+        finally:
+            os.chdir(cwd)
+        finished = time.perf_counter()
+        self._build_time = finished - start
+
+        print(
+            "Built book {name}: startup {startup:.2f}s, build {build:.2f}s\n".format(
+                name=self.name(),
+                startup=started - start,
+                build=finished - started
+            )
+        )
+        self._built = True
+
+    def build_subprocess(self, capture=False):
+        """Build the book by running 'mkdocs build' in a new process.
+        If capture is True the output of MkDocs is collected and returned
+        instead of being passed through to the terminal (used when several
+        books are built in parallel).
+        """
         print("Building partial book", self.name())
-        print()
-        p = Popen(['mkdocs', 'build'], cwd=self.src_root())
-        p.wait()
-        output, errors = p.communicate()
-        print(output)
-        if errors:
-            raise Exception(errors)
-        print("\n=======\n")
+        start = time.perf_counter()
+        if capture:
+            p = Popen(
+                ['mkdocs', 'build'],
+                cwd=self.src_root(),
+                stdout=PIPE,
+                stderr=STDOUT,
+                universal_newlines=True
+            )
+            output, _ = p.communicate()
+        else:
+            print()
+            p = Popen(['mkdocs', 'build'], cwd=self.src_root())
+            p.wait()
+            output = None
+            print("\n=======\n")
+        if p.returncode:
+            raise BuildError(self, output)
+        self._build_time = time.perf_counter() - start
+        print("Built book {name} in {time:.2f}s".format(
+            name=self.name(),
+            time=self._build_time
+        ))
         self._built = True
+        return output
+
+    def build_time(self):
+        """Wall time (seconds) of the last build, or None if not built."""
+        return self._build_time
 
     def common(self, serialized=False):
         """The common part of a mkdocs.yml file."""
@@ -121,6 +235,35 @@ class AbstractBook(object):
         """The configuration dictionary."""
         return self.project().config(key, self)
 
+    def index_file(self):
+        """The search index generated by MkDocs for this book."""
+        return os.path.join(
+            self.site_root(),
+            'search',
+            'search_index.json'
+        )
+
+    def input_hash(self):
+        """A content hash over everything that goes into building the book:
+        the docs/ tree, the generated mkdocs.yml file, the project's
+        template, defaults and configuration and the book's configuration.
+        If this hash is unchanged since the last build the book
+        doesn't have to be built again.
+        """
+        root = self.project().root()
+        hasher = new_hash()
+        hash_tree(hasher, os.path.join(self.src_root(), 'docs'), root)
+        for file in [
+            self.target_file(),
+            self.project().template_file(),
+            self.project().defaults_file(),
+            self.project().config_file(),
+            self._config_file,
+            self._nav_file
+        ]:
+            hash_file(hasher, file, root)
+        return hasher.hexdigest()
+
     def is_main_book(self):
         """Return True if this is a main book, False for a sub book."""
         return isinstance(self, MainBook)
@@ -129,6 +272,28 @@ class AbstractBook(object):
         """Return the link text used for this book."""
         return self.title()
 
+    def load_config(self):
+        """(Re)read the book's configuration and navigation files.
+        This discards any changes made to the navigation
+        when merging the sources.
+        """
+        self._read_config()
+        self._read_nav()
+
+    def _read_config(self):
+        # Only publish the configuration once it is complete,
+        # other threads may read it concurrently.
+        config = read_yaml(self._config_file)
+        config['src_dir'] = 'books/{}'.format(self._name)
+        self._config = config
+
+    def _read_nav(self):
+    # TODO:
+    # https://github.com/uliska/mkdocs-library/issues/1
+        self._nav = {
+            'nav': read_yaml(self._nav_file)
+        }
+
     def name(self):
         """The book 'name' (i.e. the path segment addressing it)"""
         return self._name
@@ -138,12 +303,30 @@ class AbstractBook(object):
         Either a reference to the internal dictionary
         or as a serialized multiline string.
         """
+        if self._nav is None:
+            self._read_nav()
         return serialize_yaml(self._nav) if serialized else self._nav
 
+    def original_index_file(self):
+        """Copy of the search index as originally generated by MkDocs.
+        This is kept in the project's state directory because the
+        index in the site is overwritten when merging the indexes.
+        """
+        return self.project().state_file(
+            'indexes',
+            '{}.json'.format(self.name())
+        )
+
     def project(self):
         """Reference to the parent project."""
         return self._project
 
+    def reset_search_index(self):
+        """Discard the search index object,
+        e.g. after the book has been rebuilt.
+        """
+        self._search_index = None
+
     def search_index(self):
         """A (generated) search index.
         This is generated by MkDocs and will be updated in the process.
@@ -151,13 +334,16 @@ class AbstractBook(object):
         """
         if not self._search_index:
             from .indexes import SearchIndex
-            self._search_index = SearchIndex(self)
+            self._search_index = SearchIndex(
+                self,
+                streaming=self.project().stream_indexes()
+            )
 
         return self._search_index
 
     def set_nav(self, navigation):
         if type(navigation) == str:
-            self._nav = oyaml.load(navigation)
+            self._nav = load_yaml(navigation)
             if not 'nav' in self._nav:
                 self._nav = {
                     'nav': self._nav
@@ -169,10 +355,49 @@ class AbstractBook(object):
         """The root directory of the rendered HTML book."""
         return self._site_root
 
+    def source_hash(self):
+        """A content hash over everything the generated mkdocs.yml file
+        depends on: the project's template, defaults and configuration
+        (including the program defaults), the book's configuration and
+        navigation, and the list of books the sibling links point to.
+        If this hash is unchanged since the last run the file
+        doesn't have to be generated again.
+        """
+        project = self.project()
+        hasher = new_hash()
+        for file in [
+            project.template_file(),
+            project.defaults_file(),
+            project.config_file(),
+            project.program_config_file(),
+            self._config_file,
+            self._nav_file
+        ]:
+            hash_file(hasher, file, project.root())
+        for book in project.books():
+            hasher.update('{}\0{}\0{}\n'.format(
+                book.name(), book.link_text(), book.is_main_book()
+            ).encode('utf-8'))
+        return hasher.hexdigest()
+
     def src_root(self):
         """The root directory of the Markdown sources."""
         return self._src_root
 
+    def store_original_index(self):
+        """Keep a copy of the freshly built search index,
+        or remove an outdated copy if the book doesn't have an index.
+        The copy keeps the modification time of the index, so it can be
+        recognized if the index is still the original one
+        (see indexes.refresh_original_indexes()).
+        """
+        original = self.original_index_file()
+        if os.path.exists(self.index_file()):
+            os.makedirs(os.path.dirname(original), exist_ok=True)
+            shutil.copy2(self.index_file(), original)
+        elif os.path.exists(original):
+            os.remove(original)
+
     def target_file(self):
         """The mkdocs.yml file where the generated configuration is stored."""
         return self._target_file
@@ -187,27 +412,44 @@ class AbstractBook(object):
         """
 
         template = self.project().template()
-        for item in self.project().defaults():
-            # TODO: In order to make this work the 'src_dir' "default"
-            # is added to the project defaults dictionary.
-            # This approach is convoluted and intransparent and should be fixed.
-            # And the edit_uri handling has to be considered with regard to
-            # the "known" providers where it will currently probably fail to
-            # insert the books/<<<src_dir>>> part.
-            template = template.replace(
-                '<<<{}>>>'.format(item),
-                self.config(item) or self.project().defaults(item)
-            )
-
-        self._common = result = oyaml.load(template, Loader=oyaml.SafeLoader)
+        # TODO: In order to make this work the 'src_dir' "default"
+        # is added to the project defaults dictionary.
+        # This approach is convoluted and intransparent and should be fixed.
+        # And the edit_uri handling has to be considered with regard to
+        # the "known" providers where it will currently probably fail to
+        # insert the books/<<<src_dir>>> part.
+        self._common = result = template.fill({
+            field: self.config(field) or self.project().defaults(field)
+            for field in template.fields()
+        })
 
         # Calculate the relative directory where the book will be rendered to
         result['site_name'] = self.config('book_name')
-        result['site_dir'] = '../../{root}{path}'.format(
-            root = self.config('site_root'),
-            path = self.site_path()
+        # (this is the shard's directory when building with --shard)
+        result['site_dir'] = os.path.relpath(
+            self.site_root(),
+            os.path.dirname(self.target_file())
         )
 
+        # Let themes find the library index (a theme partial may
+        # render the books from it, see Project.task_library_index())
+        if self.project().siblings_nav(self) == 'index':
+            result['extra'] = dict(result.get('extra') or {})
+            result['extra']['library_index'] = '{}{}'.format(
+                '' if self.is_main_book() else '../', SIBLINGS_JSON
+            )
+
+        # Let the git-revision-date-localized plugin read the dates
+        # from the cache written by mkdocs-library
+        if self.config('revision_date_cache') and 'plugins' in result:
+            result['plugins'] = replace_revision_plugin(
+                result['plugins'],
+                os.path.relpath(
+                    self.project().state_file(REVISION_DATES_FILE),
+                    os.path.dirname(self.target_file())
+                )
+            )
+
     def use_tabs(self):
         """Return True if the book uses Material's tabs feature."""
         return self.common().get(
@@ -217,15 +459,23 @@ class AbstractBook(object):
         ).get('tabs', False)
 
     def write_yaml(self):
-        """Write the generated content to a file."""
+        """Write the generated content to a file.
+        The file is only written if its content has changed, so its
+        modification time is kept otherwise. Returns True if written.
+        """
         content = (
             MKDOCS_HEADER_COMMENT
             + self.common(serialized=True)
             + self.nav(serialized=True)
         )
 
+        if os.path.exists(self.target_file()):
+            with open(self.target_file(), 'r') as f:
+                if f.read() == content:
+                    return False
         with open(self.target_file(), 'w') as f:
             f.write(content)
+        return True
 
 
 class MainBook(AbstractBook):
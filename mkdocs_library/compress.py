@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Write precompressed .gz (and .br) sidecar files for a generated site
+"""
+
+import gzip
+import io
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .util import new_hash, read_json, write_json
+
+# Brotli is optional (pip install mkdocs-library[brotli])
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Files smaller than this are not worth being compressed
+MIN_SIZE = 1024
+
+
+def _gzip(data):
+    """Compress with gzip, without a timestamp so the output is stable."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(
+        filename='', mode='wb', fileobj=buffer, compresslevel=9, mtime=0
+    ) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+def _compressors():
+    """The available (extension, function) pairs."""
+    result = [('gz', _gzip)]
+    if brotli:
+        result.append(('br', _brotli))
+    return result
+
+
+def _compress_file(file, cached):
+    """Write the sidecars for a single file.
+    Returns a tuple with the new cache entry and the number
+    of bytes saved per sidecar type, or None for the latter
+    if the file was unchanged and its sidecars still exist.
+    """
+    with open(file, 'rb') as f:
+        data = f.read()
+    digest = new_hash()
+    digest.update(data)
+    digest = digest.hexdigest()
+
+    compressors = _compressors()
+    if (
+        cached
+        and cached.get('hash') == digest
+        and all(
+            os.path.exists('{}.{}'.format(file, ext))
+            for ext, _ in compressors
+            if cached.get(ext)
+        )
+        and all(ext in cached for ext, _ in compressors)
+    ):
+        return cached, None
+
+    entry = {'hash': digest}
+    saved = {}
+    for ext, compress in compressors:
+        sidecar = '{}.{}'.format(file, ext)
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            temp_file = sidecar + '.tmp'
+            with open(temp_file, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_file, sidecar)
+            entry[ext] = len(compressed)
+            saved[ext] = len(data) - len(compressed)
+        else:
+            # Not worth it, don't (or no longer) provide a sidecar
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+            entry[ext] = None
+    return entry, saved
+
+
+def compress_site(site_dir, cache_file, extensions, exclude=None, jobs=None):
+    """Write .gz (and if available .br) sidecars for all files
+    in site_dir with one of the given extensions.
+    Files whose content hash matches the one in the cache file
+    (and whose sidecars exist) are skipped.
+    Directories in 'exclude' (absolute paths) are not processed.
+    Returns a dictionary with statistics.
+    """
+    extensions = tuple('.' + ext.lstrip('.') for ext in extensions)
+    exclude = [os.path.normpath(directory) for directory in exclude or []]
+    files = []
+    for root, dirs, filenames in os.walk(site_dir):
+        dirs[:] = [
+            d for d in dirs
+            if not os.path.normpath(os.path.join(root, d)) in exclude
+        ]
+        for filename in filenames:
+            file = os.path.join(root, filename)
+            if filename.endswith(extensions) and os.path.getsize(file) >= MIN_SIZE:
+                files.append(file)
+
+    cache = read_json(cache_file)
+    new_cache = {}
+    stats = {
+        'files': len(files),
+        'compressed': 0,
+        'unchanged': 0,
+        'saved': {ext: 0 for ext, _ in _compressors()}
+    }
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            lambda file: _compress_file(
+                file, cache.get(os.path.relpath(file, site_dir))
+            ),
+            files
+        )
+        for file, (entry, saved) in zip(files, results):
+            new_cache[os.path.relpath(file, site_dir)] = entry
+            if saved is None:
+                stats['unchanged'] += 1
+            else:
+                stats['compressed'] += 1
+                for ext, size in saved.items():
+                    stats['saved'][ext] += size
+
+    # Remove sidecars whose source file has gone
+    for rel_path, entry in cache.items():
+        if rel_path in new_cache:
+            continue
+        for ext, _ in _compressors():
+            sidecar = os.path.join(site_dir, '{}.{}'.format(rel_path, ext))
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+
+    write_json(cache_file, new_cache)
+    return stats
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Deduplicate identical assets of the books in a generated site
+"""
+
+import os
+import re
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .util import content_digest, read_json, write_json
+
+
+# Quoted strings in HTML files, which may be relative references
+# (in attributes, but also e.g. in a theme's configuration stored
+# as JSON in a script element)
+_QUOTED_RE = re.compile(r'''(["'])([^"'\s<>]+)\1''')
+
+# src and href attributes in HTML tags. Within text (e.g. in code
+# blocks) '<' is escaped, so this doesn't match there.
+_ATTRIBUTE_RE = re.compile(
+    r'''(<[a-zA-Z][^<>]*?\s(?:src|href)\s*=\s*)(["'])([^"'\s<>]+)\2''',
+    re.IGNORECASE
+)
+
+# References in CSS files
+_CSS_URL_RE = re.compile(r'''url\(\s*["']?([^"')\s]+)''')
+
+# URLs that are not relative to the document (scheme, absolute
+# path, protocol-relative or fragment only)
+_ABSOLUTE_RE = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*:|/|#)')
+
+
+def _split_url(url):
+    """Split a relative URL into its path and the rest (query and
+    fragment), or return None if the URL isn't relative.
+    """
+    if _ABSOLUTE_RE.match(url):
+        return None
+    match = re.search(r'[?#]', url)
+    if not match:
+        return url, ''
+    return url[:match.start()], url[match.start():]
+
+
+def _resolve(base_dir, url):
+    """Return the normalized path a relative URL points to
+    (relative to the same directory as base_dir), or None.
+    """
+    parts = _split_url(url)
+    if not parts or not parts[0]:
+        return None
+    return os.path.normpath(os.path.join(base_dir, parts[0]))
+
+
+def _walk(directory, exclude, extensions, skip=()):
+    """Return the paths (relative to directory) of the files with
+    one of the extensions, skipping the (absolute) directories in
+    exclude and the top-level subdirectories in skip.
+    """
+    result = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(
+            d for d in dirs
+            if not os.path.normpath(os.path.join(root, d)) in exclude
+            and not (root == directory and d in skip)
+        )
+        for file in sorted(files):
+            if file.endswith(extensions):
+                result.append(
+                    os.path.relpath(os.path.join(root, file), directory)
+                )
+    return result
+
+
+def _file_entry(file, cached):
+    """Return the cache entry ([size, mtime, hash]) for a file,
+    only hashing the content if size or modification time
+    differ from the cached entry.
+    """
+    stat = os.stat(file)
+    if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached
+    return [stat.st_size, stat.st_mtime_ns, content_digest(file)]
+
+
+def _replace_file(source, target):
+    """Atomically replace target with a hardlink to source."""
+    temp_file = target + '.tmp'
+    if os.path.lexists(temp_file):
+        os.remove(temp_file)
+    os.link(source, temp_file)
+    os.replace(temp_file, target)
+
+
+def _remove_empty_dirs(directory, stop):
+    """Remove directory and its parents up to stop if they are empty."""
+    while (
+        os.path.normpath(directory) != os.path.normpath(stop)
+        and os.path.isdir(directory)
+        and not os.listdir(directory)
+    ):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def _html_references(file, site_dir, shared_dir, extensions):
+    """Return the files in shared_dir (relative to it) referenced by
+    an HTML file, and the files with one of the extensions outside
+    shared_dir (relative to site_dir) that are referenced other than
+    by src or href attributes (e.g. in an inline script). As only the
+    attributes are rewritten (see _rewrite_html()) the latter have
+    to be kept in the books.
+    """
+    with open(file, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        content = f.read()
+    base_dir = os.path.dirname(file)
+    attributes = set(m.start(3) for m in _ATTRIBUTE_RE.finditer(content))
+    shared = set()
+    pinned = set()
+    for match in _QUOTED_RE.finditer(content):
+        path = _resolve(base_dir, match.group(2))
+        if not path:
+            continue
+        if path.startswith(shared_dir + os.sep):
+            shared.add(os.path.relpath(path, shared_dir))
+        elif path.endswith(extensions) and not match.start(2) in attributes:
+            pinned.add(os.path.relpath(path, site_dir))
+    return [sorted(shared), sorted(pinned)]
+
+
+def _rewrite_html(file, tree, moved, shared_dir):
+    """Rewrite the src and href attributes referencing the files in
+    'moved' (relative to the tree the HTML file belongs to) to point
+    to the shared directory.
+    The file is only written if anything has been replaced.
+    """
+    with open(file, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        content = f.read()
+    base_dir = os.path.dirname(file)
+
+    def replace(match):
+        parts = _split_url(match.group(3))
+        path = _resolve(base_dir, match.group(3))
+        if not path:
+            return match.group(0)
+        rel_path = os.path.relpath(path, tree)
+        if not rel_path in moved:
+            return match.group(0)
+        url = os.path.relpath(
+            os.path.join(shared_dir, rel_path), base_dir
+        ).replace(os.sep, '/')
+        return match.group(1) + match.group(2) + url + parts[1] + match.group(2)
+
+    new_content = _ATTRIBUTE_RE.sub(replace, content)
+    if new_content == content:
+        return
+    temp_file = file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8', errors='surrogateescape') as f:
+        f.write(new_content)
+    os.replace(temp_file, file)
+
+
+def _css_references(file, rel_path):
+    """Return the paths (relative to the book) referenced by a CSS file
+    at rel_path in the book.
+    """
+    with open(file, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        content = f.read()
+    base_dir = os.path.dirname(rel_path)
+    return [
+        path for path in (
+            _resolve(base_dir, url) for url in _CSS_URL_RE.findall(content)
+        ) if path
+    ]
+
+
+def _link_groups(groups, hashes, site_dir, stats):
+    """Replace the duplicates in each group by hardlinks
+    to the first file of the group.
+    """
+    for (rel_path, _), members in groups.items():
+        if len(members) < 2:
+            continue
+        source = os.path.join(members[0], rel_path)
+        source_stat = os.stat(source)
+        stats['groups'] += 1
+        for tree in members[1:]:
+            target = os.path.join(tree, rel_path)
+            if not os.path.samefile(source, target):
+                try:
+                    _replace_file(source, target)
+                except OSError:
+                    # E.g. the file system doesn't support hardlinks
+                    continue
+                stats['new'] += 1
+                hashes[os.path.relpath(target, site_dir)] = hashes[
+                    os.path.relpath(source, site_dir)
+                ]
+            stats['files'] += 1
+            stats['bytes'] += source_stat.st_size
+
+
+def _share_groups(
+    groups, trees, site_dir, shared_dir, exclude, extensions,
+    cache, hashes, stats
+):
+    """Move the files of groups with several files (or with a file that is
+    already in the shared directory) to the shared directory
+    and rewrite the references in the HTML files of the books.
+    Files that are referenced in a way that can't be rewritten
+    (see _html_references()) are kept in the books.
+    """
+    shared = cache.get('shared', {})
+    html_cache = cache.get('html', {})
+
+    # Find out which shared files are still referenced.
+    # HTML files are only read if they have changed since the last run.
+    html_files = _walk(site_dir, exclude, ('.html',))
+    new_html = {}
+    for rel_path in html_files:
+        file = os.path.join(site_dir, rel_path)
+        stat = os.stat(file)
+        cached = html_cache.get(rel_path)
+        if (
+            cached and len(cached) == 4
+            and cached[:2] == [stat.st_size, stat.st_mtime_ns]
+        ):
+            new_html[rel_path] = cached
+        else:
+            new_html[rel_path] = [stat.st_size, stat.st_mtime_ns] + (
+                _html_references(file, site_dir, shared_dir, extensions)
+            )
+    used = set(ref for entry in new_html.values() for ref in entry[2])
+    pinned = set(ref for entry in new_html.values() for ref in entry[3])
+    # Files referenced by used shared CSS files are used as well
+    pending = [ref for ref in used if ref.endswith('.css')]
+    while pending:
+        rel_path = pending.pop()
+        file = os.path.join(shared_dir, rel_path)
+        if not os.path.exists(file):
+            continue
+        for ref in _css_references(file, rel_path):
+            if not ref in used:
+                used.add(ref)
+                if ref.endswith('.css'):
+                    pending.append(ref)
+    for rel_path in sorted(set(shared) - used):
+        file = os.path.join(shared_dir, rel_path)
+        if os.path.exists(file):
+            os.remove(file)
+            _remove_empty_dirs(os.path.dirname(file), shared_dir)
+        del shared[rel_path]
+
+    # Choose the groups to be shared. A file that differs from
+    # the shared file with the same path is kept in the book.
+    chosen = OrderedDict()
+    for (rel_path, digest), members in groups.items():
+        if any(
+            os.path.relpath(os.path.join(tree, rel_path), site_dir) in pinned
+            for tree in members
+        ):
+            continue
+        if rel_path in shared:
+            if shared[rel_path] == digest:
+                chosen[(rel_path, digest)] = members
+        elif len(members) > 1:
+            chosen[(rel_path, digest)] = members
+
+    # CSS files are only shared if the files they refer to are shared too
+    # (with the same relative paths the references then remain valid).
+    def is_shared(tree, rel_path):
+        return any(
+            path == rel_path and tree in members
+            for (path, _), members in chosen.items()
+        ) or not os.path.exists(os.path.join(tree, rel_path))
+
+    changed = True
+    while changed:
+        changed = False
+        for (rel_path, digest), members in list(chosen.items()):
+            if not rel_path.endswith('.css'):
+                continue
+            references = _css_references(
+                os.path.join(members[0], rel_path), rel_path
+            )
+            if not all(
+                is_shared(tree, ref) for tree in members for ref in references
+            ):
+                del chosen[(rel_path, digest)]
+                changed = True
+
+    moved = {}
+    for (rel_path, digest), members in chosen.items():
+        target = os.path.join(shared_dir, rel_path)
+        files = [os.path.join(tree, rel_path) for tree in members]
+        size = os.path.getsize(files[0])
+        if os.path.exists(target):
+            saved = len(files)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(files.pop(0), target)
+            saved = len(files)
+        for file in files:
+            os.remove(file)
+        for tree in members:
+            _remove_empty_dirs(
+                os.path.dirname(os.path.join(tree, rel_path)), tree
+            )
+            moved.setdefault(tree, set()).add(rel_path)
+            hashes.pop(
+                os.path.relpath(os.path.join(tree, rel_path), site_dir), None
+            )
+        shared[rel_path] = digest
+        stats['groups'] += 1
+        stats['files'] += saved
+        stats['bytes'] += saved * size
+
+    # Rewrite the references in the HTML files of the affected books
+    for tree, rel_paths in moved.items():
+        for rel_path in _walk(
+            tree, exclude | set(trees) - set([tree]), ('.html',)
+        ):
+            file = os.path.join(tree, rel_path)
+            _rewrite_html(file, tree, rel_paths, shared_dir)
+            stat = os.stat(file)
+            new_html[os.path.relpath(file, site_dir)] = [
+                stat.st_size, stat.st_mtime_ns
+            ] + (
+                _html_references(file, site_dir, shared_dir, extensions)
+            )
+    stats['new'] = stats['files']
+    cache['shared'] = shared
+    cache['html'] = new_html
+
+
+def dedupe_site(
+    site_dir, trees, cache_file, extensions, mode='hardlink',
+    shared_dir=None, exclude=None, jobs=None
+):
+    """Deduplicate files with one of the given extensions that are
+    identical and have the same path in several of the trees
+    (the books' output directories, which may be nested, e.g. the main
+    book's directory is the site root).
+    With mode 'hardlink' the duplicates are replaced by hardlinks to one
+    of them. With mode 'shared' they are moved to shared_dir, and the
+    references in the books' HTML files are rewritten; files in the
+    books' search directories (which are loaded by the search scripts
+    relative to the book) are not moved in this mode.
+    Directories in 'exclude' (absolute paths) are not processed.
+    Content hashes and (in 'shared' mode) the references to shared files
+    are cached between runs in cache_file.
+    Returns a dictionary with statistics.
+    """
+    extensions = tuple('.' + ext.lstrip('.') for ext in extensions)
+    trees = [os.path.normpath(tree) for tree in trees]
+    exclude = set(os.path.normpath(directory) for directory in exclude or [])
+    if shared_dir:
+        shared_dir = os.path.normpath(shared_dir)
+        exclude.add(shared_dir)
+    cache = read_json(cache_file)
+    previous = cache.get('assets', {})
+
+    files = []
+    for tree in trees:
+        for rel_path in _walk(
+            tree, exclude | set(trees) - set([tree]), extensions,
+            skip=['search'] if mode == 'shared' else []
+        ):
+            files.append((tree, rel_path))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = list(executor.map(
+            lambda item: _file_entry(
+                os.path.join(*item),
+                previous.get(os.path.relpath(os.path.join(*item), site_dir))
+            ),
+            files
+        ))
+    hashes = {}
+    groups = OrderedDict()
+    for (tree, rel_path), entry in zip(files, entries):
+        hashes[os.path.relpath(os.path.join(tree, rel_path), site_dir)] = entry
+        groups.setdefault((rel_path, entry[2]), []).append(tree)
+
+    stats = {'groups': 0, 'files': 0, 'bytes': 0, 'new': 0}
+    if mode == 'hardlink':
+        _link_groups(groups, hashes, site_dir, stats)
+    elif mode == 'shared':
+        _share_groups(
+            groups, trees, site_dir, shared_dir, exclude, extensions,
+            cache, hashes, stats
+        )
+    else:
+        raise Exception("Unknown asset deduplication mode: {}".format(mode))
+    cache['assets'] = hashes
+    write_json(cache_file, cache)
+    return stats
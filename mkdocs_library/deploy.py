@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Incrementally deploy a generated site to a target directory
+"""
+
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .util import content_digest, read_json, write_json
+
+
+def _scan(site_dir, exclude):
+    """Return the relative paths of all files in site_dir,
+    skipping the (absolute) directories in 'exclude'.
+    """
+    result = []
+    for root, dirs, files in os.walk(site_dir):
+        dirs[:] = sorted(
+            d for d in dirs
+            if not os.path.normpath(os.path.join(root, d)) in exclude
+        )
+        for file in sorted(files):
+            result.append(
+                os.path.relpath(os.path.join(root, file), site_dir)
+            )
+    return result
+
+
+def _file_entry(site_dir, rel_path, cached):
+    """Return the manifest entry ([size, mtime, hash]) for a file.
+    The content is only hashed if size or modification time differ
+    from the cached entry.
+    """
+    stat = os.stat(os.path.join(site_dir, rel_path))
+    if (
+        cached
+        and cached[0] == stat.st_size
+        and cached[1] == stat.st_mtime_ns
+    ):
+        return cached
+    return [
+        stat.st_size,
+        stat.st_mtime_ns,
+        content_digest(os.path.join(site_dir, rel_path))
+    ]
+
+
+def _deploy_file(source, target, hardlink):
+    """Atomically replace target with (a hardlink to or a copy of)
+    source. Falls back to copying if hardlinking isn't possible
+    (e.g. across file systems).
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_file = target + '.mkdocs-library.tmp'
+    if os.path.lexists(temp_file):
+        os.remove(temp_file)
+    if hardlink:
+        try:
+            os.link(source, temp_file)
+        except OSError:
+            shutil.copy2(source, temp_file)
+    else:
+        shutil.copy2(source, temp_file)
+    os.replace(temp_file, target)
+
+
+def _merge_changes(pending, changes):
+    """Combine the changes that haven't been handled yet (e.g. because
+    the deploy script failed) with the changes of the current run,
+    so they describe all changes since the last successful deploy.
+    """
+    state = {}
+    for kind in ['added', 'changed', 'removed']:
+        for rel_path in pending.get(kind, []):
+            state[rel_path] = kind
+    for rel_path in changes['added']:
+        state[rel_path] = (
+            'changed' if state.get(rel_path) == 'removed' else 'added'
+        )
+    for rel_path in changes['changed']:
+        state[rel_path] = (
+            'added' if state.get(rel_path) == 'added' else 'changed'
+        )
+    for rel_path in changes['removed']:
+        if state.get(rel_path) == 'added':
+            del state[rel_path]
+        else:
+            state[rel_path] = 'removed'
+    return {
+        kind: sorted(p for p, k in state.items() if k == kind)
+        for kind in ['added', 'changed', 'removed']
+    }
+
+
+def sync_site(
+    site_dir, target_dir, manifest_file, changes_file,
+    exclude=None, hardlink=False, keep_pending=False, jobs=None
+):
+    """Synchronize target_dir with site_dir, using the manifest of content
+    hashes written at the last run: only added and changed files are
+    copied (or hardlinked), files that have been removed from the site
+    are removed from the target directory. Other files in the target
+    directory are left alone.
+    The lists of added, changed and removed files (relative paths)
+    are written to changes_file, e.g. for a script that uploads them.
+    With keep_pending the changes already listed in changes_file
+    (which haven't been handled yet, see Project.task_deploy())
+    are merged with the new changes instead of being replaced.
+    Returns a dictionary with statistics.
+    """
+    exclude = [os.path.normpath(directory) for directory in exclude or []]
+    manifest = read_json(manifest_file)
+    # A manifest for another target directory is useless
+    previous = (
+        manifest.get('files', {})
+        if manifest.get('target') == target_dir else {}
+    )
+    files = _scan(site_dir, exclude)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = list(executor.map(
+            lambda rel_path: _file_entry(
+                site_dir, rel_path, previous.get(rel_path)
+            ),
+            files
+        ))
+    current = dict(zip(files, entries))
+
+    changes = {'added': [], 'changed': [], 'removed': []}
+    stats = {
+        'transferred': 0,
+        'transferred_bytes': 0,
+        'skipped': 0,
+        'skipped_bytes': 0,
+        'removed': 0
+    }
+    to_deploy = []
+    for rel_path, entry in current.items():
+        old = previous.get(rel_path)
+        target = os.path.join(target_dir, rel_path)
+        if old and old[2] == entry[2] and os.path.exists(target):
+            stats['skipped'] += 1
+            stats['skipped_bytes'] += entry[0]
+            continue
+        changes['changed' if old else 'added'].append(rel_path)
+        to_deploy.append(rel_path)
+        stats['transferred'] += 1
+        stats['transferred_bytes'] += entry[0]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(
+            lambda rel_path: _deploy_file(
+                os.path.join(site_dir, rel_path),
+                os.path.join(target_dir, rel_path),
+                hardlink
+            ),
+            to_deploy
+        ))
+
+    for rel_path in sorted(set(previous) - set(current)):
+        target = os.path.join(target_dir, rel_path)
+        if os.path.lexists(target):
+            os.remove(target)
+        changes['removed'].append(rel_path)
+        stats['removed'] += 1
+        # Remove directories that have become empty
+        directory = os.path.dirname(target)
+        while (
+            os.path.normpath(directory) != os.path.normpath(target_dir)
+            and os.path.isdir(directory)
+            and not os.listdir(directory)
+        ):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    if keep_pending and manifest.get('target') == target_dir:
+        changes = _merge_changes(read_json(changes_file), changes)
+    write_json(changes_file, changes)
+    write_json(manifest_file, {'target': target_dir, 'files': current})
+    return stats
@@ -28,10 +28,705 @@ Handle search indexes generated by MkDocs
 """
 
 
+import glob
+import itertools
 import json
 import os
+import re
+import shutil
+import threading
 
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .util import (
+    content_digest, new_hash, parallel_map, read_json, write_json
+)
+
+# lunr.py is optional, it is needed to rebuild prebuilt indexes
+# (pip install mkdocs-library[lunr])
+try:
+    from lunr.lunr import get_default_builder
+except ImportError:
+    get_default_builder = None
+
+
+# Decoder used for reading search indexes (incrementally)
+_decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+
+class _JSONStream(object):
+    """
+    Minimal incremental reader for a JSON file.
+    Values are decoded one at a time from a buffer that is refilled
+    from the file as needed, so only the value currently being decoded
+    (plus one chunk) has to be held in memory.
+    """
+
+    def __init__(self, file, chunk_size=1 << 16):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size):
+        """Read more data, dropping the consumed part of the buffer."""
+        chunk = self._file.read(size)
+        if not chunk:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+    def expect(self, char):
+        """Consume the given (structural) character or raise a ValueError."""
+        if self.peek() != char:
+            raise ValueError("Expected '{}' in {} at position {}".format(
+                char, self._file.name, self._pos
+            ))
+        self._pos += 1
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it,
+        or an empty string at the end of the file.
+        """
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in ' \t\n\r'
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                break
+            self._fill(self._chunk_size)
+        return self._buffer[self._pos:self._pos + 1]
+
+    def value(self):
+        """Decode and consume the next JSON value."""
+        self.peek()
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may be incomplete
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Read increasingly large chunks to avoid decoding
+            # a large value over and over again
+            self._fill(size)
+            size *= 2
+
+
+def iter_index(file):
+    """Read a search index file incrementally.
+    Yields (key, value) pairs for the top-level entries. For the 'docs'
+    entry the value is an iterator over the doc dictionaries, which
+    has to be exhausted before the iteration continues.
+    """
+    with open(file, 'r') as f:
+        stream = _JSONStream(f)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            if key == 'docs':
+                yield key, _iter_array(stream)
+            else:
+                yield key, stream.value()
+            if stream.peek() == ',':
+                stream.expect(',')
+        stream.expect('}')
+
+
+def _iter_array(stream):
+    """Iterate over the elements of a JSON array in a stream."""
+    stream.expect('[')
+    while stream.peek() != ']':
+        yield stream.value()
+        if stream.peek() == ',':
+            stream.expect(',')
+    stream.expect(']')
+
+
+def _write_array(f, items):
+    """Write the items of an iterable as a JSON array, one by one.
+    The result is identical to json.dumps() of the whole list.
+    """
+    f.write('[')
+    first = True
+    for item in items:
+        if not first:
+            f.write(', ')
+        f.write(json.dumps(item))
+        first = False
+    f.write(']')
+
+
+def _write_object(f, entries):
+    """Write (key, value) pairs as a JSON object, one by one.
+    The value of a 'docs' entry may be any iterable and is
+    written with _write_array().
+    """
+    f.write('{')
+    first = True
+    for key, value in entries:
+        if not first:
+            f.write(', ')
+        f.write(json.dumps(key) + ': ')
+        if key == 'docs':
+            _write_array(f, value)
+        else:
+            f.write(json.dumps(value))
+        first = False
+    f.write('}')
+
+
+def _write_slices(f, slices):
+    """Write the docs of (name, docs) slices as a single JSON array,
+    identical to json.dumps() of the concatenated docs.
+    'docs' is an iterable over doc dictionaries or a _CopiedSlice.
+    'f' has to be a _CountingWriter, the positions of the slices
+    in the output are returned as a list of [name, start, end].
+    """
+    f.write('[')
+    first = True
+    positions = []
+    for name, docs in slices:
+        start = f.tell()
+        if isinstance(docs, _CopiedSlice):
+            if not docs.empty():
+                # Drop the separator preceding the copied docs
+                # if they are the first ones in the array
+                for chunk in docs.chunks(skip=2 if first else 0):
+                    f.write(chunk)
+                first = False
+        else:
+            for doc in docs:
+                if not first:
+                    f.write(', ')
+                f.write(json.dumps(doc))
+                first = False
+        positions.append([name, start, f.tell()])
+    f.write(']')
+    return positions
+
+
+class _CountingWriter(object):
+    """
+    Wrapper around a file keeping track of the number of characters
+    (or bytes) written. As json.dumps() produces ASCII output
+    this is also the byte position in the written file.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._pos = 0
+
+    def tell(self):
+        return self._pos
+
+    def write(self, data):
+        self._file.write(data)
+        self._pos += len(data)
+
+
+def _iter_range(source, start, end=None):
+    """Iterate over the bytes from start to end (or to the end
+    of the file) of a binary file, in chunks.
+    """
+    source.seek(start)
+    remaining = -1 if end is None else end - start
+    while remaining:
+        chunk = source.read(
+            1 << 16 if remaining < 0 else min(remaining, 1 << 16)
+        )
+        if not chunk:
+            break
+        yield chunk
+        if remaining > 0:
+            remaining -= len(chunk)
+
+
+def _copy_range(source, out, start, end=None):
+    """Copy the bytes from start to end (or to the end of the file)
+    from a binary file to a _CountingWriter, in chunks.
+    """
+    for chunk in _iter_range(source, start, end):
+        out.write(chunk)
+
+
+# The start of each doc in a merged index (as written by json.dumps()
+# of the dictionaries created by SearchIndex.foreign_doc()), and the
+# prefix of the locations in the docs as seen from a sub book
+_DOC_START = b'{"location": "'
+_SUB_BOOK_PREFIX = b'../'
+
+
+class _CopiedSlice(object):
+    """
+    The docs of a book as stored in (a slice of) another book's
+    merged index file, which are copied byte by byte instead of
+    generating them from the book's parsed index.
+    As seen from the main book the docs only differ from those seen
+    from a sub book by the prefix of the locations (see
+    SearchIndex.update_location()), so this is added or removed
+    while copying if the slice is taken from the other kind of book.
+    """
+
+    def __init__(self, file, start, end, from_main, to_main):
+        self._file = file
+        self._start = start
+        self._end = end
+        self._replace = None
+        if from_main and not to_main:
+            self._replace = (_DOC_START, _DOC_START + _SUB_BOOK_PREFIX)
+        elif to_main and not from_main:
+            self._replace = (_DOC_START + _SUB_BOOK_PREFIX, _DOC_START)
+
+    def chunks(self, skip=0):
+        """Iterate over the docs as (ASCII) strings, in chunks,
+        skipping the first 'skip' bytes (the separator preceding them).
+        Quotes within JSON strings are escaped, so the start of a doc
+        can't be mistaken for anything else.
+        """
+        with open(self._file, 'rb') as f:
+            chunks = _iter_range(f, self._start + skip, self._end)
+            if not self._replace:
+                for chunk in chunks:
+                    yield chunk.decode('ascii')
+                return
+            old, new = self._replace
+            pending = b''
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is None:
+                    data = pending
+                    cut = len(data)
+                else:
+                    data = pending + chunk
+                    # Keep the end of the data that may be the
+                    # start of an occurrence for the next chunk
+                    cut = max(len(data) - len(old) + 1, 0)
+                    pos = data.find(old, max(cut - len(old) + 1, 0))
+                    if pos != -1 and pos < cut:
+                        cut = pos + len(old)
+                yield data[:cut].replace(old, new).decode('ascii')
+                pending = data[cut:]
+
+    def empty(self):
+        """True if the slice contains no docs."""
+        return self._end == self._start
+
+
+def _copied_slices(indexes, previous, status):
+    """Find the slices in the existing merged indexes that can be
+    copied into other merged indexes (see _CopiedSlice). These are
+    taken from indexes that are unchanged or only have to be patched
+    (so their files still match the manifest entries in 'previous')
+    and whose slices are up to date.
+    Returns a dictionary mapping (book name, seen from the main book)
+    to (file, start, end, taken from the main book).
+    """
+    hashes = {i.book().name(): i.foreign_hash() for i in indexes}
+    result = {}
+    for index in indexes:
+        entry = previous.get(index.book().name())
+        if (
+            not status.get(index.book().name()) in ['patch', 'unchanged']
+            or not entry['patchable']
+        ):
+            continue
+        main = index.book().is_main_book()
+        for name, start, end, digest in entry['slices']:
+            if digest == hashes.get(name):
+                result.setdefault(
+                    (name, main), (index.index_file(), start, end, main)
+                )
+    return result
+
+
+class _LunrIndexer(object):
+    """
+    Build a prebuilt lunr index like MkDocs' search plugin does,
+    honouring the 'lang' and 'separator' settings of the search config.
+    Docs are added while they are passed through feed(),
+    so an index can be built while the docs are being written.
+    """
+
+    def __init__(self, config):
+        separator = re.compile(config.get('separator') or r'[\s\-]+')
+
+        def extractor(field):
+            # lunr.py's tokenizer can't be configured with a separator,
+            # but it accepts lists of already separated tokens.
+            return lambda doc: [
+                token for token in separator.split(doc.get(field) or '') if token
+            ]
+
+        self._builder = get_default_builder(config.get('lang'))
+        self._builder.ref('location')
+        for field in ['title', 'text']:
+            self._builder.field(field, extractor=extractor(field))
+
+    def feed(self, docs):
+        """Add docs to the index while iterating over them."""
+        for doc in docs:
+            self._builder.add(doc)
+            yield doc
+
+    def serialize(self):
+        """The serialized index, as stored in the 'index' entry."""
+        return self._builder.build().serialize()
+
+
+def build_lunr_index(docs, config):
+    """Return a serialized lunr index for the docs."""
+    indexer = _LunrIndexer(config)
+    for doc in indexer.feed(docs):
+        pass
+    return indexer.serialize()
+
+
+_lunr_warning_shown = False
+
+
+def can_prebuild(config, enabled=True):
+    """Return True if a prebuilt index is to be (re)built for
+    an index with the given search configuration.
+    Prints a warning if lunr.py is not available.
+    """
+    if not (enabled and config.get('prebuild_index')):
+        return False
+    if not get_default_builder:
+        global _lunr_warning_shown
+        if not _lunr_warning_shown:
+            print(
+                "WARNING: Can't rebuild the prebuilt search index because "
+                "lunr.py is not installed (pip install lunr). The outdated "
+                "prebuilt index is removed instead."
+            )
+            _lunr_warning_shown = True
+        return False
+    return True
+
+
+def rebuild_prebuilt_indexes(indexes, jobs=1, enabled=True):
+    """Replace the prebuilt lunr index of (merged) indexes
+    by one that includes all docs. Indexes are built in up to
+    'jobs' processes, as building them is CPU-bound.
+    If rebuilding is disabled or not possible the now outdated
+    prebuilt index is removed (the browser will then build it).
+    """
+    targets = [i for i in indexes if i.has_prebuilt_index()]
+    if not targets:
+        return
+    if not can_prebuild(targets[0].config(), enabled):
+        for i in targets:
+            i.json().pop('index', None)
+        return
+    args = ([i.docs() for i in targets], [i.config() for i in targets])
+    if jobs > 1 and len(targets) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(build_lunr_index, *args))
+    else:
+        results = list(map(build_lunr_index, *args))
+    for i, result in zip(targets, results):
+        i.json()['index'] = result
+
+
+# Manifest recording the composition of the merged per-book indexes
+# (relative to the project's state directory)
+INDEX_MANIFEST_FILE = 'index-manifest.json'
+
+# Fingerprints of the index files in the site as last written
+# by merge-indexes (relative to the project's state directory)
+WRITTEN_INDEXES_FILE = 'indexes/written.json'
+
+
+def _fingerprint(file):
+    """Return [size, mtime] of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def refresh_original_indexes(project, books):
+    """Make sure the copies of the books' original indexes (see
+    AbstractBook.store_original_index()) are current before any index
+    in the site is overwritten. The index in the site is copied (again)
+    unless it is the file the copy has been made from (the copy keeps
+    its size and modification time) or the file last written by
+    merge-indexes, i.e. if the book has been built since then in any
+    other way (e.g. with 'mkdocs build').
+    """
+    written = read_json(project.state_file(WRITTEN_INDEXES_FILE))
+    for book in books:
+        current = _fingerprint(book.index_file())
+        if not current or current in [
+            written.get(book.name()),
+            _fingerprint(book.original_index_file())
+        ]:
+            continue
+        book.store_original_index()
+
+
+def record_written_indexes(project, indexes):
+    """Record the fingerprints of the index files in the site
+    after merging (see refresh_original_indexes()).
+    """
+    write_json(project.state_file(WRITTEN_INDEXES_FILE), {
+        i.book().name(): _fingerprint(i.index_file()) for i in indexes
+    })
+
+# How a book's docs are included in the other books' indexes
+# (see SearchIndex.foreign_doc())
+FOREIGN_DOCS_MODES = ['full', 'excerpt', 'headings', 'title']
+
+
+def write_merged_indexes(project, indexes, jobs=1, prebuild=True, targets=None):
+    """Extend each book's index with the docs of all other books
+    (the 'per-book' index mode), doing as little work as possible:
+    - indexes whose own and merged-in indexes are all unchanged
+      since the last run are skipped
+    - in indexes where only other books' indexes have changed
+      the slices of these books are replaced (see patch_merged())
+    - all other indexes are written completely, but the slices of
+      unchanged books are copied from other merged indexes where
+      possible (see _copied_slices())
+    Indexes are only read and parsed when they are actually needed,
+    so usually only the changed indexes are parsed.
+    The composition of each merged index is recorded in a manifest
+    in the project's state directory.
+    If 'targets' is given only these indexes are written,
+    but they are still merged with all indexes.
+    Returns a dictionary with the number of indexes per status.
+    """
+    if targets is None:
+        targets = indexes
+    manifest_file = project.state_file(INDEX_MANIFEST_FILE)
+    manifest = read_json(manifest_file)
+    previous = {}
+    if manifest.get('prebuild') == prebuild:
+        previous = manifest.get('indexes', {})
+    books = [i.book() for i in indexes]
+    # Hash the original indexes (without parsing them)
+    parallel_map(lambda i: i.original_hash(), indexes, jobs)
+    status = OrderedDict(
+        (i.book().name(), i.merge_status(previous.get(i.book().name()), books))
+        for i in indexes
+    )
+    merge = [i for i in targets if status[i.book().name()] == 'merge']
+    patch = [i for i in targets if status[i.book().name()] == 'patch']
+
+    # Slices of other books that can be copied into the merged indexes.
+    # (An index with a prebuilt lunr index needs all docs anyway.)
+    available = _copied_slices(indexes, previous, status) if merge else {}
+    copies = {}
+    for i in merge:
+        copies[i] = {}
+        if i.has_prebuilt_index():
+            continue
+        to_main = i.book().is_main_book()
+        for b in books:
+            found = (
+                available.get((b.name(), to_main))
+                or available.get((b.name(), not to_main))
+            )
+            if b != i.book() and found:
+                file, start, end, from_main = found
+                copies[i][b.name()] = _CopiedSlice(
+                    file, start, end, from_main, to_main
+                )
+
+    # Load the indexes needed for merging/patching in parallel
+    needed = set(merge)
+    for i in merge:
+        needed.update(
+            b.search_index() for b in books if not b.name() in copies[i]
+        )
+    if patch:
+        needed.update(
+            i for i in indexes
+            if previous.get(i.book().name(), {}).get('hash') != i.original_hash()
+        )
+    parallel_map(lambda i: i.load(), [i for i in indexes if i in needed], jobs)
+
+    if indexes and not indexes[0].streaming():
+        for i in merge:
+            if i.has_prebuilt_index():
+                i.update(books)
+        with project.profiler().span('index prebuild'):
+            rebuild_prebuilt_indexes(merge, jobs, prebuild)
+    # The merged indexes have to be written before patching
+    # the indexes their slices may be copied from.
+    entries = {}
+    entries.update(zip(
+        [i.book().name() for i in merge],
+        parallel_map(
+            lambda i: i.write_merged(books, prebuild, copies[i]), merge, jobs
+        )
+    ))
+    entries.update(zip(
+        [i.book().name() for i in patch],
+        parallel_map(
+            lambda i: i.patch_merged(previous[i.book().name()], books),
+            patch,
+            jobs
+        )
+    ))
+
+    new_manifest = OrderedDict()
+    new_manifest['prebuild'] = prebuild
+    new_manifest['indexes'] = OrderedDict(
+        (name, entries.get(name) or previous[name])
+        for name in [i.book().name() for i in indexes]
+        if name in entries or name in previous
+    )
+    write_json(manifest_file, new_manifest)
+    result = OrderedDict((key, 0) for key in ['merge', 'patch', 'unchanged'])
+    for i in targets:
+        result[status[i.book().name()]] += 1
+    return result
+
+
+def check_index_budgets(project, indexes):
+    """Compare the size of the merged per-book indexes with the
+    'search_index_budget' of their books (as recorded in the manifest
+    written by write_merged_indexes()).
+    Returns a list of (book name, size, budget) tuples for the
+    indexes exceeding their budget.
+    """
+    manifest = read_json(project.state_file(INDEX_MANIFEST_FILE))
+    entries = manifest.get('indexes', {})
+    result = []
+    for index in indexes:
+        book = index.book()
+        budget = book.config('search_index_budget')
+        entry = entries.get(book.name())
+        if budget and entry and entry['size'] > int(budget):
+            result.append((book.name(), entry['size'], int(budget)))
+    return result
+
+
+def print_index_report(project, indexes):
+    """Print the size of each merged per-book index and
+    how many bytes each book adds to the other books' indexes
+    (as recorded in the manifest written by write_merged_indexes()).
+    """
+    manifest = read_json(project.state_file(INDEX_MANIFEST_FILE))
+    entries = manifest.get('indexes', {})
+    added = OrderedDict((i.book().name(), []) for i in indexes)
+    for entry in entries.values():
+        for name, start, end, _ in entry['slices']:
+            added.setdefault(name, []).append(end - start)
+    print("{:<24} {:>12} {:>12} {:>14} {:>14}".format(
+        'book', 'index bytes', 'foreign', 'adds per index', 'adds in total'
+    ))
+    for name, sizes in added.items():
+        entry = entries.get(name)
+        print("{:<24} {:>12} {:>12} {:>14} {:>14}".format(
+            name,
+            entry['size'] if entry else '-',
+            sum(s[2] - s[1] for s in entry['slices']) if entry else '-',
+            sum(sizes) // len(sizes) if sizes else 0,
+            sum(sizes)
+        ))
+
+
+# Name of the combined search index at the site root
+# (used with the 'combined' index mode).
+LIBRARY_INDEX_FILE = 'library_search_index.json'
+
+
+def write_library_index(project, indexes, jobs=1, prebuild=True):
+    """Write a single search index for the whole library to the site root
+    and replace the books' own indexes with stubs pointing to it.
+    The locations in the combined index are relative to the site root.
+    The search configuration is taken from the first book's index,
+    if that asks for a prebuilt index it is built for all docs
+    (unless 'prebuild' is False).
+    The stubs are written with up to 'jobs' threads.
+    """
+    file = os.path.join(project.site_directory(), LIBRARY_INDEX_FILE)
+    temp_file = file + '.tmp'
+    config = indexes[0].config() if indexes else {}
+    docs = (doc for index in indexes for doc in index.iter_root_docs())
+    indexer = None
+    if can_prebuild(config, prebuild):
+        indexer = _LunrIndexer(config)
+        docs = indexer.feed(docs)
+    with open(temp_file, 'w') as f:
+        f.write('{"config": ')
+        f.write(json.dumps(config))
+        f.write(', "docs": ')
+        _write_array(f, docs)
+        if indexer:
+            f.write(', "index": ')
+            f.write(json.dumps(indexer.serialize()))
+        f.write('}')
+    os.replace(temp_file, file)
+    parallel_map(
+        lambda index: index.write_stub(LIBRARY_INDEX_FILE), indexes, jobs
+    )
+
+
+# Locations of the shard manifest, the shards and the loader script
+# relative to the site root (used with the 'sharded' index mode).
+SHARDS_MANIFEST_FILE = 'search/shards.json'
+SHARDS_DIR = 'search/shards'
+SHARDS_LOADER_FILE = 'search/library-search.js'
+
+
+def write_sharded_index(project, indexes, jobs=1):
+    """Write each book's docs once as a content-hashed shard,
+    together with a manifest listing the shards and a loader script.
+    Each book's own index is kept (so the book can still be searched
+    with the theme's standard search) and references the manifest.
+    The locations in the shards are relative to the site root.
+    Shards and book indexes are written with up to 'jobs' threads.
+    """
+    site_dir = project.site_directory()
+    shards_dir = os.path.join(site_dir, SHARDS_DIR)
+    os.makedirs(shards_dir, exist_ok=True)
+    manifest = OrderedDict()
+    manifest['config'] = indexes[0].config() if indexes else {}
+    manifest['shards'] = parallel_map(
+        lambda index: index.write_shard(shards_dir), indexes, jobs
+    )
+
+    # Remove shards left over from previous runs
+    current = set(shard['file'] for shard in manifest['shards'])
+    for file in glob.glob(os.path.join(shards_dir, '*.json')):
+        if os.path.relpath(file, site_dir) not in current:
+            os.remove(file)
+
+    # Files in the site may be hardlinked (e.g. from a shard's output
+    # or to a deploy target), so they are replaced, never overwritten.
+    manifest_file = os.path.join(site_dir, SHARDS_MANIFEST_FILE)
+    with open(manifest_file + '.tmp', 'w') as f:
+        f.write(json.dumps(manifest))
+    os.replace(manifest_file + '.tmp', manifest_file)
+    loader_file = os.path.join(site_dir, SHARDS_LOADER_FILE)
+    shutil.copyfile(
+        os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'assets',
+            'library-search.js'
+        ),
+        loader_file + '.tmp'
+    )
+    os.replace(loader_file + '.tmp', loader_file)
+    parallel_map(
+        lambda index: index.write_shard_reference(SHARDS_MANIFEST_FILE),
+        indexes,
+        jobs
+    )
+
 
 class SearchIndex(object):
     """
@@ -40,24 +735,50 @@ class SearchIndex(object):
     the other books of the site.
     """
 
-    def __init__(self, book):
+    def __init__(self, book, streaming=False):
         self._book = book
-        self._file = os.path.join(
-            book.site_root(),
-            'search',
-            'search_index.json'
-        )
-        self._original_plain = self.read_original()
-        # NOTE: This is modifiable, concretely the 'docs' element
-        # will be changed in-place
-        self._json = json.loads(
-            self._original_plain, object_pairs_hook=OrderedDict
-        )
+        self._file = book.index_file()
+        # In streaming mode the index is never loaded as a whole,
+        # see write_merged()
+        self._streaming = streaming
+        self._json = None
+        self._original_docs = None
+        self._original_prebuilt = None
+        self._original_hash = None
+        # Docs with locations updated for other books, see updated_docs()
+        self._updated_docs = {}
+        # How the docs are included in other books' indexes,
+        # see foreign_doc()
+        self._foreign_docs = book.config('foreign_docs') or 'full'
+        if not self._foreign_docs in FOREIGN_DOCS_MODES:
+            raise Exception(
+                "Invalid value for 'foreign_docs' in book '{}': {}".format(
+                    book.name(), self._foreign_docs
+                )
+            )
+        self._excerpt_length = int(book.config('foreign_excerpt_length') or 0)
+        self._foreign_hash = None
+        # load() and updated_docs() may be requested from several threads
+        self._lock = threading.RLock()
 
     def book(self):
         """Return a reference to the book this index belongs to."""
         return self._book
 
+    def config(self):
+        """The search configuration ('config' element) of the index."""
+        if not self.streaming():
+            return self.json().get('config', {})
+        for key, value in iter_index(self.original_file()):
+            if key == 'config':
+                return value
+            if key == 'docs':
+                # Skip the docs in the (unusual) case that
+                # the configuration is stored after them.
+                for doc in value:
+                    pass
+        return {}
+
     def docs(self):
         """Return the 'docs' element of the JSON dictionary.
         This is a list with dictionaries storing a location, a title and a text.
@@ -67,50 +788,236 @@ class SearchIndex(object):
         """
         return self.json()['docs']
 
+    def foreign_doc(self, doc, location):
+        """Return the copy of a doc that is included in other books'
+        indexes (with the given location), trimmed according to
+        the book's 'foreign_docs' setting, or None if the doc is left
+        out ('title' mode includes only the entries for whole pages,
+        not those for sections).
+        """
+        mode = self._foreign_docs
+        if mode == 'title' and '#' in location:
+            return None
+        text = doc['text']
+        if mode in ['title', 'headings']:
+            text = ''
+        elif mode == 'excerpt' and len(text) > self._excerpt_length:
+            text = text[:self._excerpt_length]
+        return {
+            'location': location,
+            'text': text,
+            'title': doc['title']
+        }
+
+    def foreign_hash(self):
+        """Hash identifying the docs this index contributes to other
+        books' indexes: the original index and the trimming settings.
+        """
+        if self._foreign_hash is None:
+            hasher = new_hash()
+            hasher.update('{} {} {}'.format(
+                self.original_hash(), self._foreign_docs, self._excerpt_length
+            ).encode('utf-8'))
+            self._foreign_hash = hasher.hexdigest()
+        return self._foreign_hash
+
+    def has_prebuilt_index(self):
+        """True if the original index contains a prebuilt lunr index."""
+        self.load()
+        return self._original_prebuilt is not None
+
     def index_file(self):
         """The absolute path of the JSON file in the generated site."""
         return self._file
 
+    def iter_original_docs(self):
+        """Iterate over the original docs,
+        read incrementally from the file in streaming mode.
+        """
+        if not self.streaming():
+            yield from self.original_docs()
+            return
+        for key, value in iter_index(self.original_file()):
+            if key == 'docs':
+                yield from value
+                return
+
+    def iter_original(self):
+        """Iterate over the (key, value) pairs of the original index.
+        The value of 'docs' is an iterable over the original docs.
+        """
+        if self.streaming():
+            yield from iter_index(self.original_file())
+            return
+        for key, value in self.json().items():
+            if key == 'docs':
+                value = self.original_docs()
+            yield key, value
+
+    def iter_root_docs(self):
+        """Iterate over copies of the original docs,
+        with locations relative to the site root.
+        """
+        for d in self.iter_original_docs():
+            yield {
+                'location': self.root_location(d['location']),
+                'text': d['text'],
+                'title': d['title']
+            }
+
+    def iter_updated_docs(self, from_book):
+        """Iterate over copies of the original docs
+        with locations updated as seen from from_book.
+        Unlike updated_docs() nothing is kept in memory.
+        """
+        for d in self.iter_original_docs():
+            doc = self.foreign_doc(
+                d, self.update_location(d['location'], from_book)
+            )
+            if doc:
+                yield doc
+
     def json(self):
         """The JSON representation in its current (modified) state."""
+        self.load()
         return self._json
 
+    def load(self):
+        """Read and parse the original index, unless this has already
+        been done. The index is not loaded before it is actually needed,
+        so indexes that don't have to be merged again are never parsed.
+        Does nothing in streaming mode.
+        """
+        with self._lock:
+            if self._json is not None or self.streaming():
+                return
+            with self._profiler().span('index load', self.book()):
+                # NOTE: This is modifiable, concretely the 'docs' element
+                # will be changed in-place
+                self._json = json.loads(
+                    self.read_original(), object_pairs_hook=OrderedDict
+                )
+                # The original docs, parsed only once.
+                # (The list is copied because docs() will be extended,
+                # the doc dictionaries themselves are never modified.)
+                self._original_docs = list(self._json['docs'])
+                # The prebuilt lunr index (if any), which is replaced
+                # or removed in the merged index.
+                self._original_prebuilt = self._json.get('index')
+
+    def merge_status(self, entry, books):
+        """Compare the index with the state recorded in a manifest entry
+        (see write_merged()) when it was last merged.
+        Returns 'unchanged' if neither the book's own index nor any of
+        the merged-in indexes have changed, 'patch' if only slices of
+        other books have to be replaced (see patch_merged()),
+        or 'merge' if the index has to be merged completely.
+        """
+        if not entry or entry['hash'] != self.original_hash():
+            return 'merge'
+        others = [b for b in books if b != self.book()]
+        if [s[0] for s in entry['slices']] != [b.name() for b in others]:
+            return 'merge'
+        try:
+            stat = os.stat(self.index_file())
+        except FileNotFoundError:
+            return 'merge'
+        if [stat.st_size, stat.st_mtime_ns] != [entry['size'], entry['mtime']]:
+            # The file has been replaced, e.g. by rebuilding the book
+            return 'merge'
+        if all(
+            s[3] == b.search_index().foreign_hash()
+            for s, b in zip(entry['slices'], others)
+        ):
+            return 'unchanged'
+        return 'patch' if entry['patchable'] else 'merge'
+
     def original_docs(self):
         """
-        A copy of the docs element of the *original* JSON file.
-        Created upon each request.
+        The docs element of the *original* JSON file.
+        NOTE: This list is shared and must not be modified.
+        """
+        self.load()
+        return self._original_docs
+
+    def original_file(self):
+        """The file containing the index as originally generated by MkDocs.
+        This is the copy of the index stored after building the book
+        (and refreshed by refresh_original_indexes() if the book has
+        been built otherwise), as the file in the site may already
+        have been merged before.
+        """
+        file = self.book().original_index_file()
+        if not os.path.exists(file):
+            file = self.index_file()
+        return file
+
+    def original_hash(self):
+        """Hash of the original index file's content.
+        This is computed (without parsing the file) upon first request.
         """
-        return self.original_json()['docs']
+        if self._original_hash is None:
+            self._original_hash = content_digest(self.original_file())
+        return self._original_hash
 
     def original_json(self):
         """
         JSON representation of the original file (as generated by MkDocs).
-        This is created upon each request from the origina text file content.
+        This is created upon each request from the original file.
         """
         return json.loads(self.original_plain(), object_pairs_hook=OrderedDict)
 
     def original_plain(self):
-        """The original file as plain text (single string)."""
-        return self._original_plain
+        """The original file as plain text (single string).
+        Read upon each request.
+        """
+        return self.read_original()
 
     def read_original(self):
         """Read the original JSON file."""
-        with open(self.index_file(), 'r') as f:
+        with open(self.original_file(), 'r') as f:
             return f.read()
 
+    def root_docs(self):
+        """Return a new list with copies of the original docs,
+        with locations relative to the site root.
+        """
+        return list(self.iter_root_docs())
+
+    def root_link(self):
+        """The relative link from this book's root to the site root."""
+        return '' if self.book().is_main_book() else '../'
+
+    def root_location(self, location):
+        """Return a location as relative to the site root.
+        MkDocs generates locations relative to the book's root,
+        so locations in subbooks are prepended with '<subbook>/'.
+        """
+        to_link = (
+            '' if self.book().is_main_book()
+            else '{}/'.format(self.book().name())
+        )
+        return to_link + location
+
+    def streaming(self):
+        """True if the index is processed in streaming mode."""
+        return self._streaming
+
     def update(self, books):
         """Update the index by appending the indexes of the singling books.
-
+        The docs are reset to the original docs first, so this can
+        be called again (e.g. after other books have been rebuilt).
         """
-        docs = self.docs()
-        book = self.book()
-        for b in books:
-            other = b.search_index()
-            if other != self:
-                # Add list of the indexes in `other`,
-                # with locations updated as pointing
-                # to the target locations from here
-                docs.extend(other.updated_docs(book))
+        with self._profiler().span('index update', self.book()):
+            docs = self.json()['docs'] = list(self.original_docs())
+            book = self.book()
+            for b in books:
+                other = b.search_index()
+                if other != self:
+                    # Add list of the indexes in `other`,
+                    # with locations updated as pointing
+                    # to the target locations from here
+                    docs.extend(other.updated_docs(book))
 
     def update_location(self, location, from_book):
         """Update a location as pointing from another book.
@@ -135,27 +1042,234 @@ class SearchIndex(object):
             '' if from_book.is_main_book()
             else '../'
         )
-        to_link = (
-            '' if self.book().is_main_book()
-            else '{}/'.format(self.book().name())
-        )
-        return from_link + to_link + location
+        return from_link + self.root_location(location)
 
     def updated_docs(self, from_book):
-        """Return a new list with new doc dictionaries,
-        as copies of the original docs with updated location links.
-        """
-        docs = self.original_docs()
-        result = []
-        for d in docs:
-            result.append({
-                'location': self.update_location(d['location'], from_book),
-                'text': d['text'],
-                'title': d['title']
-            })
-        return result
+        """Return a list with new doc dictionaries,
+        as copies of the original docs with updated location links
+        (and trimmed, see foreign_doc()).
+        The updated locations only depend on whether from_book is the
+        main book, so the list is created at most twice and then shared
+        between all books.
+        NOTE: The returned list must not be modified.
+        """
+        key = from_book.is_main_book()
+        with self._lock:
+            if not key in self._updated_docs:
+                docs = (
+                    self.foreign_doc(
+                        d, self.update_location(d['location'], from_book)
+                    )
+                    for d in self.original_docs()
+                )
+                self._updated_docs[key] = [d for d in docs if d]
+            return self._updated_docs[key]
+
+    def patch_merged(self, entry, books):
+        """Replace the slices of other books whose index has changed
+        in the merged index file, according to the manifest entry
+        written by write_merged() (or by a previous patch).
+        The book's own part and the unchanged slices are copied
+        byte by byte, so neither the file nor the unchanged indexes
+        are parsed. Returns the updated manifest entry.
+        """
+        with self._profiler().span('index patch', self.book()):
+            return self._patch_merged(entry, books)
+
+    def _patch_merged(self, entry, books):
+        others = [b for b in books if b != self.book()]
+        temp_file = self.index_file() + '.tmp'
+        slices = []
+        with open(self.index_file(), 'rb') as source:
+            with open(temp_file, 'wb') as f:
+                out = _CountingWriter(f)
+                pos = 0
+                for (name, start, end, digest), book in zip(entry['slices'], others):
+                    _copy_range(source, out, pos, start)
+                    new_start = out.tell()
+                    other = book.search_index()
+                    if digest == other.foreign_hash():
+                        _copy_range(source, out, start, end)
+                    else:
+                        # The own docs are never empty in a patchable
+                        # index, so each doc is preceded by a separator.
+                        for doc in self._updated_docs_of(other):
+                            out.write(b', ' + json.dumps(doc).encode('ascii'))
+                    slices.append([name, new_start, out.tell(), other.foreign_hash()])
+                    pos = end
+                _copy_range(source, out, pos)
+        os.replace(temp_file, self.index_file())
+        return self._manifest_entry(slices, entry['patchable'])
+
+    def write_merged(self, books, prebuild=True, copies=None):
+        """Write the index extended with the docs of the other books.
+        'copies' may map book names to _CopiedSlice objects, which are
+        then written instead of the book's docs (unless a prebuilt
+        index is built from the docs while writing them).
+        In streaming mode the original index is read and written
+        entry by entry, otherwise the (loaded) index is written,
+        including a prebuilt index rebuilt by rebuild_prebuilt_indexes().
+        The result is the same in both modes, and identical to
+        json.dumps() of the merged index.
+        The merged index is written to a temporary file which then
+        atomically replaces the index file.
+        Returns a manifest entry recording the position of each other
+        book's docs in the file, used by merge_status() and patch_merged().
+        """
+        with self._profiler().span('index write', self.book()):
+            return self._write_merged(books, prebuild, copies or {})
+
+    def _write_merged(self, books, prebuild, copies):
+        temp_file = self.index_file() + '.tmp'
+        slices = []
+        patchable = True
+        with open(temp_file, 'w') as f:
+            out = _CountingWriter(f)
+            out.write('{')
+            first = True
+            for key, value in self._iter_merged_entries(books, prebuild, copies):
+                if not first:
+                    out.write(', ')
+                out.write(json.dumps(key) + ': ')
+                if key == 'docs':
+                    slices = _write_slices(out, value)
+                    # Without own docs the first doc of another book is
+                    # not preceded by a separator, and slices can't be
+                    # replaced independently.
+                    own_name, own_start, own_end = slices.pop(0)
+                    patchable = own_end > own_start
+                else:
+                    if key == 'index':
+                        # A prebuilt index has to be rebuilt
+                        # whenever any of the docs change
+                        patchable = False
+                    out.write(json.dumps(value))
+                first = False
+            out.write('}')
+        os.replace(temp_file, self.index_file())
+        return self._manifest_entry(
+            [
+                [name, start, end, b.search_index().foreign_hash()]
+                for (name, start, end), b in zip(
+                    slices, [b for b in books if b != self.book()]
+                )
+            ],
+            patchable
+        )
+
+    def _iter_merged_entries(self, books, prebuild, copies):
+        """Iterate over the entries of the merged index.
+        The value of 'docs' is a list of (book name, docs) slices,
+        starting with the own docs (see _write_slices()).
+        In streaming mode a prebuilt lunr index is built from the docs
+        while they are written (MkDocs stores it after the docs),
+        or dropped.
+        """
+        config = {}
+        indexer = None
+        for key, value in self.iter_original():
+            if key == 'config':
+                config = value
+            if key == 'docs':
+                if self.streaming() and can_prebuild(config, prebuild):
+                    indexer = _LunrIndexer(config)
+                    copies = {}
+                value = [(self.book().name(), value)] + [
+                    (
+                        b.name(),
+                        copies.get(b.name())
+                        or self._updated_docs_of(b.search_index())
+                    )
+                    for b in books if b != self.book()
+                ]
+                if indexer:
+                    value = [(name, indexer.feed(docs)) for name, docs in value]
+            elif key == 'index' and self.streaming():
+                if not indexer:
+                    continue
+                value = indexer.serialize()
+            yield key, value
+
+    def _profiler(self):
+        return self.book().project().profiler()
+
+    def _manifest_entry(self, slices, patchable):
+        """Create a manifest entry for the just written merged index."""
+        stat = os.stat(self.index_file())
+        entry = OrderedDict()
+        entry['hash'] = self.original_hash()
+        entry['patchable'] = patchable
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime_ns
+        entry['slices'] = slices
+        return entry
 
-    def write(self):
-        """Write the (updated) JSON to the index file."""
-        with open(self.index_file(), 'w') as f:
-            f.write(json.dumps(self.json()))
+    def _updated_docs_of(self, other):
+        """The docs of another book's index as seen from this book.
+        In streaming mode they are read incrementally from the file.
+        """
+        if other.streaming():
+            return other.iter_updated_docs(self.book())
+        return other.updated_docs(self.book())
+
+    def write_stub(self, library_index):
+        """Replace the index file with a stub pointing to a library index.
+        The stub keeps the search configuration but has no docs.
+        'library_index' is the location of the combined index and
+        'location_prefix' has to be prepended to the (root-relative)
+        locations in it, both relative to this book's root.
+        Themes have to follow the stub in order to search the library.
+        The stub is written to a temporary file which then replaces
+        the index file, as that may be hardlinked (e.g. from a shard's
+        output, see task_gather()).
+        """
+        stub = OrderedDict()
+        stub['config'] = self.config()
+        stub['docs'] = []
+        stub['library_index'] = self.root_link() + library_index
+        stub['location_prefix'] = self.root_link()
+        temp_file = self.index_file() + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(json.dumps(stub))
+        os.replace(temp_file, self.index_file())
+
+    def write_shard(self, directory):
+        """Write the book's docs, with locations relative to the site root,
+        as a shard to the given directory. The file name contains
+        a hash of the content so unchanged shards can be cached.
+        Returns the shard's manifest entry.
+        """
+        temp_file = os.path.join(directory, '{}.json.tmp'.format(self.book().name()))
+        with open(temp_file, 'w') as f:
+            f.write('{"docs": ')
+            _write_array(f, self.iter_root_docs())
+            f.write('}')
+        file = os.path.join(directory, '{name}.{hash}.json'.format(
+            name=self.book().name(),
+            hash=content_digest(temp_file)[:12]
+        ))
+        os.replace(temp_file, file)
+
+        entry = OrderedDict()
+        entry['book'] = self.book().name()
+        entry['prefix'] = self.root_location('')
+        entry['file'] = os.path.relpath(
+            file, self.book().project().site_directory()
+        ).replace(os.sep, '/')
+        entry['size'] = os.path.getsize(file)
+        return entry
+
+    def write_shard_reference(self, manifest):
+        """Write the book's original index, extended by the book's name
+        ('book'), the location of the shard manifest ('shards') and the
+        prefix for the (root-relative) locations in the shards
+        ('location_prefix'), both relative to this book's root.
+        """
+        temp_file = self.index_file() + '.tmp'
+        with open(temp_file, 'w') as f:
+            _write_object(f, itertools.chain(self.iter_original(), [
+                ('book', self.book().name()),
+                ('shards', self.root_link() + manifest),
+                ('location_prefix', self.root_link())
+            ]))
+        os.replace(temp_file, self.index_file())
@@ -34,7 +34,7 @@ import os
 from .project import Project
 
 
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser()
     # Recipe controlling what the script actually does.
     # - command line argument takes precedence
@@ -42,7 +42,10 @@ def parse_args():
     # - project specific default can be given in the config
     parser.add_argument(
         '--recipe',
-        choices=['merge-sources', 'merge-indexes', 'build', 'deploy', 'all'],
+        choices=[
+            'merge-sources', 'merge-indexes', 'build', 'compress', 'dedupe',
+            'gather', 'serve', 'deploy', 'all'
+        ],
         help='Task (sequence) to be performed. Defaults to "build"'
     )
     parser.add_argument(
@@ -50,18 +53,89 @@ def parse_args():
         default=os.getcwd(),
         help='Project root directory, defaults to current working directory'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='Number of books to be built (and search indexes to be merged) '
+             'in parallel. Overrides the "build_jobs" and "merge_jobs" '
+             'configuration options'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=['subprocess', 'inprocess'],
+        help='How MkDocs is invoked to build the books. '
+             'Overrides the "build_engine" configuration option'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Build all books, even if they are unchanged since the last build'
+    )
+    parser.add_argument(
+        '--index-mode',
+        choices=['per-book', 'combined', 'sharded'],
+        help='How the search indexes are merged. '
+             'Overrides the "index_mode" configuration option'
+    )
+    parser.add_argument(
+        '--stream-indexes',
+        action='store_true',
+        help='Read and write search indexes incrementally to save memory'
+    )
+    parser.add_argument(
+        '--index-report',
+        action='store_true',
+        help='Print how many bytes each book adds to the merged '
+             'search indexes (with the "per-book" index mode)'
+    )
+    parser.add_argument(
+        '--shard',
+        metavar='I/N',
+        help='Build only shard I of N (a subset of the books) into its own '
+             'output directory next to the site root. '
+             'Use the "gather" recipe afterwards to assemble the site'
+    )
+    parser.add_argument(
+        '-a', '--address',
+        help='Address (host:port) used by the "serve" recipe. '
+             'Overrides the "serve_address" configuration option'
+    )
+    parser.add_argument(
+        '--books',
+        help='Comma separated list of books (or glob patterns like "op*") '
+             'to merge, build and merge the indexes of. '
+             'The other books are still linked and searched. '
+             'Defaults to all books'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='mkdocs-library-trace.json',
+        help='Record how long each task and each book\'s phases take '
+             'and write a trace file (Chrome/Perfetto trace-event JSON, '
+             'defaults to "mkdocs-library-trace.json" in the project root)'
+    )
+    parser.add_argument(
+        '--cprofile',
+        metavar='SPAN',
+        help='With --profile: run the spans with this name (e.g. a recipe '
+             'step like "merge_indexes" or a phase like "nav") with cProfile'
+    )
+    return parser.parse_args(args)
 
 
-def main():
-    # Determine the directory with the program defaults
-    config_dir = os.path.join(
+def program_defaults_dir():
+    """The directory with the program defaults."""
+    return os.path.join(
         os.path.dirname(
             os.path.realpath(__file__)
         ),
         'defaults'
     )
-    Project(parse_args(), config_dir).exec_recipe()
+
+
+def main():
+    Project(parse_args(), program_defaults_dir()).exec_recipe()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+MkDocs plugin providing the revision date of each page
+from the cache written by mkdocs-library (see revisions.py)
+"""
+
+import json
+import os
+import re
+
+from datetime import datetime, timezone
+from subprocess import DEVNULL, CalledProcessError, check_output
+
+from mkdocs.config import config_options
+from mkdocs.plugins import BasePlugin
+
+# Babel is used for localized dates if it is installed
+# (it is a dependency of the git-revision-date-localized plugin)
+try:
+    from babel.dates import format_date
+except ImportError:
+    format_date = None
+
+
+# The tag that is replaced in the Markdown of the pages
+_TAG_RE = re.compile(r'\{\{\s*git_revision_date_localized\s*\}\}')
+
+
+class RevisionDatePlugin(BasePlugin):
+    """
+    Drop-in replacement for the git-revision-date-localized plugin:
+    the formatted date of the last commit of each page is stored in
+    the page's 'git_revision_date_localized' meta value and replaces
+    the {{ git_revision_date_localized }} tag in the Markdown.
+    The dates are read from the cache file written by mkdocs-library
+    before building the books, only files missing in the cache
+    (e.g. when the book is built on its own) are looked up with git.
+    """
+
+    config_scheme = (
+        ('cache_file', config_options.Type(str, default='')),
+        ('type', config_options.Choice(
+            ['date', 'datetime', 'iso_date', 'iso_datetime', 'timeago'],
+            default='date'
+        )),
+        ('locale', config_options.Type(str, default='en')),
+    )
+
+    def on_config(self, config):
+        self._root = None
+        self._dates = {}
+        cache_file = self.config['cache_file']
+        if cache_file:
+            cache_file = os.path.join(
+                os.path.dirname(config['config_file_path']), cache_file
+            )
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            self._root = cache['root']
+            self._dates = cache['dates']
+        return config
+
+    def on_page_markdown(self, markdown, page, config, files):
+        date = self.format(self.timestamp(page.file.abs_src_path))
+        page.meta['git_revision_date_localized'] = date
+        return _TAG_RE.sub(date, markdown)
+
+    def format(self, timestamp):
+        """Format a timestamp according to the 'type' option."""
+        date = datetime.fromtimestamp(timestamp, timezone.utc)
+        kind = self.config['type']
+        locale = self.config['locale']
+        if kind == 'iso_date':
+            return date.strftime('%Y-%m-%d')
+        if kind == 'iso_datetime':
+            return date.strftime('%Y-%m-%d %H:%M:%S')
+        if kind == 'timeago':
+            return '<span class="timeago" datetime="{}" locale="{}"></span>'.format(
+                date.isoformat(), locale
+            )
+        result = (
+            format_date(date, format='long', locale=locale) if format_date
+            else date.strftime('%B %d, %Y')
+        )
+        if kind == 'datetime':
+            result += date.strftime(' %H:%M:%S')
+        return result
+
+    def timestamp(self, file):
+        """The timestamp of the last commit of a file, looked up
+        in the cache or (if it's missing there) with git. Files that
+        aren't committed yet get the current time.
+        """
+        if self._root:
+            path = os.path.relpath(
+                os.path.realpath(file), os.path.realpath(self._root)
+            ).replace(os.sep, '/')
+            if path in self._dates:
+                return self._dates[path]
+        try:
+            output = check_output(
+                ['git', 'log', '-1', '--format=%at', '--', os.path.basename(file)],
+                cwd=os.path.dirname(file),
+                stderr=DEVNULL,
+                universal_newlines=True
+            ).strip()
+        except (OSError, CalledProcessError):
+            output = ''
+        return int(output) if output else datetime.now(timezone.utc).timestamp()
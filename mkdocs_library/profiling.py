@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Record where the time of a run goes (--profile)
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# resource is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_rss():
+    """Peak resident set size of this process and of the (waited for)
+    child processes, e.g. MkDocs builds, in bytes (or None).
+    """
+    if not resource:
+        return None
+    # ru_maxrss is given in kilobytes (in bytes on macOS)
+    factor = 1 if os.uname().sysname == 'Darwin' else 1024
+    return factor * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+
+
+def _cpu_time():
+    """CPU time used by this process and its (waited for) children."""
+    if not resource:
+        return time.process_time()
+    return sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in [
+            resource.getrusage(resource.RUSAGE_SELF),
+            resource.getrusage(resource.RUSAGE_CHILDREN)
+        ]
+    )
+
+
+class NullProfiler(object):
+    """Profiler used when profiling is not enabled, doing nothing."""
+
+    @contextmanager
+    def span(self, name, book=None, category='phase'):
+        yield
+
+    def finish(self):
+        pass
+
+
+class Profiler(object):
+    """
+    Records spans (for the nodes of a recipe, see scheduler.py, and
+    the phases of each book within them) with wall time, CPU time
+    and peak RSS.
+    The spans are written as a trace-event JSON file that can be
+    opened in chrome://tracing or https://ui.perfetto.dev,
+    and summarized on stdout.
+    Optionally the spans with a given name are run with cProfile,
+    and the statistics are written next to the trace file
+    (with parallel jobs only one of concurrent spans is profiled).
+    NOTE: CPU time and peak RSS are process-wide, so with
+    parallel jobs the values of concurrent spans overlap.
+    """
+
+    def __init__(self, trace_file, cprofile_phase=None):
+        self._trace_file = trace_file
+        self._cprofile_phase = cprofile_phase
+        self._cprofile = None
+        self._cprofile_active = False
+        self._events = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, book=None, category='phase'):
+        """Context manager recording a span, optionally for a book."""
+        profile = None
+        if name == self._cprofile_phase:
+            # cProfile can only profile one thread at a time,
+            # concurrent spans (e.g. parallel builds) are skipped.
+            with self._lock:
+                if not self._cprofile_active:
+                    self._cprofile_active = True
+                    if not self._cprofile:
+                        self._cprofile = cProfile.Profile()
+                    profile = self._cprofile
+            if profile:
+                profile.enable()
+        start = time.perf_counter()
+        cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profile:
+                profile.disable()
+                self._cprofile_active = False
+            args = OrderedDict()
+            if book:
+                args['book'] = book.name()
+            args['cpu_ms'] = round((_cpu_time() - cpu) * 1000, 3)
+            rss = _peak_rss()
+            if rss is not None:
+                args['peak_rss_mb'] = round(rss / 2 ** 20, 1)
+            event = OrderedDict()
+            event['name'] = name
+            event['cat'] = category
+            event['ph'] = 'X'
+            event['ts'] = round((start - self._start) * 1e6, 1)
+            event['dur'] = round((end - start) * 1e6, 1)
+            event['pid'] = os.getpid()
+            event['tid'] = threading.get_ident()
+            event['args'] = args
+            with self._lock:
+                self._events.append(event)
+
+    def finish(self):
+        """Write the trace (and cProfile statistics) and print a summary."""
+        with open(self._trace_file, 'w') as f:
+            json.dump(
+                {'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f
+            )
+        self.print_summary()
+        print("Profile trace written to", self._trace_file)
+        if self._cprofile:
+            stats_file = os.path.splitext(self._trace_file)[0] + '.prof'
+            self._cprofile.dump_stats(stats_file)
+            print("\ncProfile statistics for '{}' (written to {}):".format(
+                self._cprofile_phase, stats_file
+            ))
+            pstats.Stats(self._cprofile).sort_stats('cumulative').print_stats(20)
+
+    def print_summary(self):
+        """Print the total wall and CPU time per span name
+        (recipe nodes first, then the phases within them).
+        """
+        totals = OrderedDict()
+        for event in sorted(
+            self._events, key=lambda e: (e['cat'] != 'node', e['ts'])
+        ):
+            total = totals.setdefault(
+                (event['cat'], event['name']),
+                {'count': 0, 'wall': 0, 'cpu': 0, 'rss': 0}
+            )
+            total['count'] += 1
+            total['wall'] += event['dur'] / 1e6
+            total['cpu'] += event['args']['cpu_ms'] / 1000
+            total['rss'] = max(total['rss'], event['args'].get('peak_rss_mb', 0))
+        print("\n{:<6} {:<22} {:>6} {:>10} {:>10} {:>12}".format(
+            '', 'span', 'count', 'wall s', 'cpu s', 'peak RSS MB'
+        ))
+        for (category, name), total in totals.items():
+            print("{:<6} {:<22} {:>6} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+                category, name, total['count'],
+                total['wall'], total['cpu'], total['rss']
+            ))
+        print()
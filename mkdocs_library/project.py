@@ -28,13 +28,60 @@ Representation of a mkdocs-library project
 """
 
 import os
-import re
+import shutil
+import tempfile
 
+from collections import OrderedDict
+from fnmatch import fnmatch
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from subprocess import Popen
 
-from .book import MainBook, SubBook
-from .util import read_yaml
+from .book import BuildError, MainBook, SubBook
+from .compress import compress_site
+from .dedupe import dedupe_site
+from .deploy import sync_site
+from .profiling import NullProfiler, Profiler
+from .revisions import REVISION_DATES_FILE, write_revision_dates
+from .scheduler import Scheduler
+from .serve import LibraryServer
+from .shards import (
+    SHARD_INFO_FILE,
+    assign_shards,
+    find_shards,
+    parse_shard,
+    replace_entries,
+    shard_directory
+)
+from .siblings import SIBLINGS_JSON, SIBLINGS_PAGE, write_sibling_index
+from .template import Template
+from .indexes import (
+    INDEX_MANIFEST_FILE,
+    LIBRARY_INDEX_FILE,
+    SHARDS_DIR,
+    SHARDS_LOADER_FILE,
+    SHARDS_MANIFEST_FILE,
+    check_index_budgets,
+    print_index_report,
+    record_written_indexes,
+    refresh_original_indexes,
+    write_library_index,
+    write_merged_indexes,
+    write_sharded_index
+)
+from .util import (
+    file_digest,
+    parallel_map,
+    read_json,
+    read_yaml,
+    write_json
+)
+
+
 
+# Name of the state directory in the site root (see Project.state_dir())
+STATE_DIR = '.mkdocs-library'
 
 class Project(object):
     """A mkdocs-library project, represents a directory structure.
@@ -42,13 +89,20 @@ class Project(object):
 
     def __init__(self, cl_args, program_defaults_dir):
 
+        # Keep the arguments to be able to reload the project
+        self._cl_args = cl_args
         # Project root directory, defaulting to current working directory
-        self._root = cl_args.root
+        # Absolute, as books may be built from another working directory
+        self._root = os.path.abspath(cl_args.root)
         # Directory with the program defaults
         self._program_defaults_dir = program_defaults_dir
-        # List of books.
-        self._books = []
+        # List of books, created upon first request (see books())
+        self._books = None
         self._main_book = None
+        # Patterns for the books the tasks are limited to (or None)
+        self._book_filter = cl_args.books
+        # Shard of the library to be built, as (index, count), or None
+        self._shard = parse_shard(cl_args.shard)
 
         # Project configuration directory
         config_dir = os.path.join(self._root, '_config')
@@ -74,10 +128,30 @@ class Project(object):
     # TODO: This should better be fixed, I think.
         self._defaults['src_dir'] = ''
         self._template = self.read_template()
-        self._books = self.load_books()
 
         # Decide which recipe is going to be executed
         self._recipe = cl_args.recipe or self.config('default_recipe')
+        # Number of parallel jobs given on the command line (or None)
+        self._jobs = cl_args.jobs
+        # Build engine given on the command line (or None)
+        self._engine = cl_args.engine
+        # Rebuild all books, even if unchanged
+        self._force = cl_args.force
+        # Search index mode given on the command line (or None)
+        self._index_mode = cl_args.index_mode
+        # Process search indexes in streaming mode
+        self._stream_indexes = cl_args.stream_indexes
+        self._index_report = cl_args.index_report
+        # Address for the 'serve' recipe given on the command line (or None)
+        self._serve_address = cl_args.address
+        # Record spans of the tasks and books (--profile)
+        if cl_args.profile:
+            self._profiler = Profiler(
+                os.path.join(self._root, cl_args.profile),
+                cl_args.cprofile
+            )
+        else:
+            self._profiler = NullProfiler()
 
     def book_nav(self, source, target, tabs=False):
         """
@@ -116,13 +190,160 @@ class Project(object):
                 title: link
             }
 
+    def book_unchanged(self, book, manifest, input_hash):
+        """True if the book doesn't have to be built again because
+        it has an output directory and its input hash matches the one
+        recorded in the build manifest (and --force is not given).
+        """
+        return (
+            not self._force
+            and manifest.get(book.name(), {}).get('hash') == input_hash
+            and os.path.isdir(book.site_root())
+        )
+
     def books(self):
         """
         Returns a list with all book objects.
         If the project has a main book it will be the first element.
+        The books are created upon first request, their configuration
+        and navigation files are only read when needed.
         """
+        if self._books is None:
+            self._books = self.load_books()
         return self._books
 
+    def build_book(self, book, manifest, capture=False):
+        """Build a single book, unless it is unchanged since the last build
+        (see book_unchanged()), and record the build in the manifest.
+        The main book is built with the output of all other books kept
+        (see build_main_book()).
+        If capture is True MkDocs' output is printed in one piece
+        when the book has finished.
+        """
+        input_hash = book.input_hash()
+        if self.book_unchanged(book, manifest, input_hash):
+            print("Skipping unchanged book", book.name())
+            return
+        output = None
+        try:
+            if book.is_main_book():
+                self.build_main_book(
+                    keep=[b for b in self.books() if b != book]
+                )
+            else:
+                output = book.build(capture=capture)
+                book.store_original_index()
+        except BuildError as e:
+            output = e.output
+            raise
+        finally:
+            if capture and output is not None:
+                print("\n======= {} =======\n".format(book.name()))
+                print(output)
+        # The book's index has to be read again when merging
+        book.reset_search_index()
+        manifest[book.name()] = {
+            'hash': input_hash,
+            'build_time': book.build_time()
+        }
+
+    def build_books(self, books, manifest):
+        """Build the given (sub) books (see build_book()),
+        in parallel if build_jobs() is greater than one.
+        """
+        jobs = self.build_jobs()
+        if jobs == 1:
+            for book in books:
+                self.build_book(book, manifest)
+            return
+
+        # Build sub books in parallel, capturing each book's output
+        # and printing it in one piece when the book has finished.
+        failed = []
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(self.build_book, book, manifest, True): book
+                for book in books
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except BuildError:
+                    failed.append(futures[future])
+        if failed:
+            raise Exception(
+                "Building the following book(s) failed:\n  {}".format(
+                    "\n  ".join(book.name() for book in failed)
+                )
+            )
+
+    def build_engine(self):
+        """The way MkDocs is invoked to build the books:
+        - 'subprocess': run 'mkdocs build' for each book
+        - 'inprocess': use MkDocs' Python API in the running interpreter
+        The --engine command line argument takes precedence
+        over the 'build_engine' configuration option.
+        """
+        engine = self._engine or self.config('build_engine') or 'subprocess'
+        if engine not in ['subprocess', 'inprocess']:
+            raise Exception("Unknown build engine: {}".format(engine))
+        return engine
+
+    def build_jobs(self):
+        """The maximum number of books to be built in parallel.
+        The --jobs command line argument takes precedence
+        over the 'build_jobs' configuration option.
+        The in-process build engine always builds one book at a time
+        because MkDocs' API isn't safe to be used from multiple threads.
+        """
+        if self.build_engine() == 'inprocess':
+            return 1
+        return max(1, int(self._jobs or self.config('build_jobs') or 1))
+
+    def build_main_book(self, keep):
+        """Build the main book.
+        As MkDocs cleans the whole site root when building the main book
+        the output of the books in 'keep', the state directory, the
+        shared assets directory and the library index are moved out
+        of the way and restored afterwards.
+        """
+        keep_dirs = [
+            self.state_dir(),
+            self.shared_assets_dir(),
+            os.path.join(self.site_directory(), SIBLINGS_PAGE),
+            os.path.join(self.site_directory(), SIBLINGS_JSON)
+        ] + [book.site_root() for book in keep]
+        parent_dir = os.path.dirname(self.site_directory())
+        os.makedirs(parent_dir, exist_ok=True)
+        stash = tempfile.mkdtemp(prefix='.mkdocs-library-', dir=parent_dir)
+        moved = []
+        try:
+            for i, directory in enumerate(keep_dirs):
+                if os.path.exists(directory):
+                    stashed = os.path.join(stash, str(i))
+                    os.rename(directory, stashed)
+                    moved.append((stashed, directory))
+            # The revision date plugin reads its cache from the state
+            # directory while the main book is built (MkDocs doesn't
+            # remove hidden directories when cleaning the site).
+            stashed_state = dict(
+                (directory, stashed) for stashed, directory in moved
+            ).get(self.state_dir())
+            cache = os.path.join(stashed_state or '', REVISION_DATES_FILE)
+            if stashed_state and os.path.exists(cache):
+                os.makedirs(self.state_dir(), exist_ok=True)
+                shutil.copy2(cache, self.state_file(REVISION_DATES_FILE))
+            self.main_book().build()
+        finally:
+            for stashed, directory in moved:
+                if os.path.isdir(directory):
+                    shutil.rmtree(directory)
+                elif os.path.exists(directory):
+                    os.remove(directory)
+                os.rename(stashed, directory)
+            os.rmdir(stash)
+        self.main_book().store_original_index()
+
     def config(self, key, book=None):
         """
         Returns a given configuration value defined on
@@ -145,6 +366,16 @@ class Project(object):
         else:
             return self._defaults
 
+    def defaults_file(self):
+        return self._defaults_file
+
+    def deploy_script(self):
+        """Absolute path to the configured deploy script."""
+        script = self.config('deploy_script')
+        if not os.path.isabs(script):
+            script = os.path.join(self.root(), script)
+        return script
+
     def exec_recipe(self):
         """Execute a given recipe, i.e. sequence of tasks."""
         recipes = {
@@ -159,6 +390,19 @@ class Project(object):
             'merge-indexes': [
                 'task_merge_indexes'
             ],
+            'gather': [
+                'task_gather',
+                'task_merge_indexes'
+            ],
+            'compress': [
+                'task_compress'
+            ],
+            'dedupe': [
+                'task_dedupe_assets'
+            ],
+            'serve': [
+                'task_serve'
+            ],
             'deploy': [
                 'task_deploy'
             ],
@@ -168,8 +412,52 @@ class Project(object):
             ]
         }
         recipe = recipes[self.recipe()]
-        for step in recipe:
-            getattr(self, step)()
+        if self._shard:
+            # A shard only merges the sources of its books and builds
+            # them, the rest is done after gathering (see task_gather())
+            if not self.recipe() in ['build', 'merge-sources']:
+                raise Exception(
+                    "--shard can only be used with the 'build' "
+                    "and 'merge-sources' recipes"
+                )
+            recipe = [step for step in recipe if step != 'task_merge_indexes']
+        # The step after which the whole site is available
+        built = None
+        if not self._shard:
+            for step in ['task_gather', 'task_build_site']:
+                if step in recipe:
+                    built = step
+        # Read the git revision dates for all books before building
+        if self.config('revision_date_cache') and 'task_build_site' in recipe:
+            recipe.insert(recipe.index('task_build_site'), 'task_revision_dates')
+        # Write the library index after building if it replaces
+        # the sibling navigation
+        if built and self.uses_library_index():
+            recipe.insert(recipe.index(built) + 1, 'task_library_index')
+        # Deduplicate the books' assets after building if requested
+        if self.config('dedupe_assets') and built:
+            last = 'task_merge_indexes'
+            if not last in recipe:
+                last = built
+            recipe.insert(recipe.index(last) + 1, 'task_dedupe_assets')
+        # Precompress the site after merging the indexes
+        # (and deduplicating the assets) if requested
+        if self.config('precompress') and 'task_merge_indexes' in recipe:
+            last = 'task_merge_indexes'
+            if 'task_dedupe_assets' in recipe:
+                last = 'task_dedupe_assets'
+            recipe.insert(recipe.index(last) + 1, 'task_compress')
+        scheduler, finishers = self.recipe_graph(recipe)
+        try:
+            try:
+                scheduler.run()
+            finally:
+                for finish in finishers:
+                    finish()
+            if any(node.book() for node in scheduler.nodes()):
+                scheduler.print_critical_path()
+        finally:
+            self.profiler().finish()
 
     # def library_nav(self, from_book):
     #     """
@@ -192,6 +480,28 @@ class Project(object):
     #     else:
     #         return None
 
+    def index_mode(self):
+        """How the books' search indexes are merged:
+        - 'per-book': every book's index is extended with
+          the docs of all other books
+        - 'combined': one index for the whole library is written
+          to the site root, the books' indexes point to it.
+        - 'sharded': each book's docs are written once as a shard,
+          the books' indexes point to a manifest listing the shards.
+        The --index-mode command line argument takes precedence
+        over the 'index_mode' configuration option.
+        """
+        mode = self._index_mode or self.config('index_mode') or 'per-book'
+        if mode not in ['per-book', 'combined', 'sharded']:
+            raise Exception("Unknown index mode: {}".format(mode))
+        return mode
+
+    def library_site_directory(self):
+        """The absolute path to the root of the whole library's site,
+        also when building a shard (see site_directory()).
+        """
+        return os.path.abspath(os.path.join(self.root(), self.site_root()))
+
     def load_books(self):
         """Create the book objects.
 
@@ -222,21 +532,68 @@ class Project(object):
 
     def main_book(self):
         """Return the MainBook object, or None."""
+        self.books()
         return self._main_book
 
+    def merge_book_sources(self, book, manifest):
+        """Merge a single book's sources (see task_merge_sources())
+        and record the result in the (sources) manifest.
+        Returns 'reused', 'regenerated' or 'written'.
+        """
+        profiler = self.profiler()
+        source_hash = book.source_hash()
+        entry = manifest.get(book.name(), {})
+        if (
+            not self._force
+            and entry.get('sources') == source_hash
+            and entry.get('output') == file_digest(
+                book.target_file(), self.root()
+            )
+        ):
+            return 'reused'
+        # fill in values for template fields
+        with profiler.span('template', book):
+            book.update_template()
+        # Generate local navigation and
+        # add links to other book parts
+        with profiler.span('nav', book):
+            self.update_nav(book)
+        # write the book's mkdocs.yml file (if changed)
+        with profiler.span('yaml', book):
+            written = book.write_yaml()
+        manifest[book.name()] = {
+            'sources': source_hash,
+            'output': file_digest(book.target_file(), self.root())
+        }
+        return 'written' if written else 'regenerated'
+
+    def merge_jobs(self):
+        """The maximum number of search indexes processed in parallel.
+        The --jobs command line argument takes precedence
+        over the 'merge_jobs' configuration option.
+        """
+        return max(1, int(self._jobs or self.config('merge_jobs') or 1))
+
     def outline_file(self):
         """The file where the book outline is configured, if present."""
         return self._outline_file
 
+    def profiler(self):
+        """The profiler recording the spans of tasks and books,
+        which does nothing unless --profile is given.
+        """
+        return self._profiler
+
+    def program_config_file(self):
+        """The configuration file with the program defaults."""
+        return os.path.join(self._program_defaults_dir, 'config.yml')
+
     def read_config(self):
         """
         Read the project's configuration file,
         overriding program defaults with any given value.
         """
-        result = read_yaml(os.path.join(
-            self._program_defaults_dir,
-            'config.yml'
-        ))
+        result = read_yaml(self.program_config_file())
         config = read_yaml(self.config_file())
 
         for key, value in config.items():
@@ -270,17 +627,14 @@ class Project(object):
         return books
 
     def read_template(self):
-        """Read the template file."""
+        """Read and compile the template file."""
 
-        template = ''
+        text = ''
         if os.path.exists(self.template_file()):
             with open(self.template_file(), 'r') as f:
-                template += f.read()
-        fields = re.findall('<<<.*>>>', template)
-        self._template_fields = []
-        for field in fields:
-            if not field[3:-3] in fields:
-                self._template_fields.append(field[3:-3])
+                text += f.read()
+        template = Template(text, self.template_file())
+        self._template_fields = template.fields()
         for field in self._template_fields:
             if not field in self.defaults():
                 raise Exception("""No default value given for template field
@@ -305,12 +659,178 @@ in configuration file
         """
         return self._recipe
 
+    def recipe_graph(self, recipe):
+        """Express a recipe as a dependency graph, returning a Scheduler
+        and a list of functions to be called after running it.
+        Merging the sources and building are split into nodes per book
+        (for the books selected with --books), so a book can be built
+        as soon as its own sources are merged:
+        - build(book) depends on merge_sources(book)
+        - sub books' builds depend on the main book's build,
+          as that cleans the whole site
+        All other tasks are global nodes depending on all previous nodes,
+        and the nodes of later steps depend on them. They are run in
+        the main thread (as nothing else can run at the same time).
+        At most build_jobs() nodes run at the same time.
+        The manifests are read when the graph is created and written
+        afterwards, because the state directory is moved away while
+        the main book is built.
+        """
+        scheduler = Scheduler(self.build_jobs(), self.profiler())
+        finishers = []
+        # The last global node, which all following nodes depend on
+        barrier = []
+        merge_nodes = {}
+        for step in recipe:
+            if step == 'task_merge_sources':
+                sources_manifest = read_json(
+                    self.state_file('sources-manifest.json')
+                )
+                results = []
+
+                def merge(book, manifest=sources_manifest, results=results):
+                    results.append(self.merge_book_sources(book, manifest))
+
+                for book in self.selected_books():
+                    merge_nodes[book] = scheduler.add(
+                        'merge_sources', partial(merge, book), barrier, book
+                    )
+                finishers.append(partial(
+                    self.write_sources_manifest, sources_manifest, results
+                ))
+            elif step == 'task_build_site':
+                manifest_file = self.state_file('build-manifest.json')
+                build_manifest = read_json(manifest_file)
+                capture = self.build_jobs() > 1
+                main = []
+                build_nodes = OrderedDict()
+                books = list(self.selected_books())
+                if self.main_book() in books:
+                    books.remove(self.main_book())
+                    books.insert(0, self.main_book())
+                for book in books:
+                    deps = barrier + main
+                    if book in merge_nodes:
+                        deps.append(merge_nodes[book])
+                    node = scheduler.add(
+                        'build',
+                        partial(
+                            self.build_book, book, build_manifest,
+                            capture and not book.is_main_book()
+                        ),
+                        deps,
+                        book
+                    )
+                    if book.is_main_book():
+                        main = [node]
+                    build_nodes[book] = node
+                finishers.append(partial(write_json, manifest_file, build_manifest))
+                if self._shard:
+                    finishers.append(partial(self.write_shard_info, build_nodes))
+            else:
+                barrier = [scheduler.add(
+                    step[len('task_'):],
+                    getattr(self, step),
+                    list(scheduler.nodes()),
+                    inline=True
+                )]
+        return scheduler, finishers
+
+    def reload(self):
+        """Return a new Project object for the same project,
+        with all configuration files read again.
+        """
+        return Project(self._cl_args, self._program_defaults_dir)
+
     def root(self):
         """The project's root directory.
         Either given on the command line or the current working directory.
         """
         return self._root
 
+    def run_deploy_script(self, env=None):
+        """Run the deploy script (see task_deploy()).
+        Raises an Exception if the script fails.
+        """
+        p = Popen([self.deploy_script()], shell=True, env=env)
+        p.wait()
+        if p.returncode:
+            raise Exception(
+                "Deploy script {} failed with exit status {}".format(
+                    self.deploy_script(), p.returncode
+                )
+            )
+
+    def selected_books(self):
+        """The books the tasks are limited to with the --books
+        command line argument (a comma separated list of names or
+        glob patterns), in library order. Defaults to all books.
+        With --shard only the books assigned to the shard are selected.
+        """
+        books = self.books()
+        if self._book_filter:
+            patterns = [
+                p.strip() for p in self._book_filter.split(',') if p.strip()
+            ]
+            for pattern in patterns:
+                if not any(fnmatch(book.name(), pattern) for book in books):
+                    raise Exception("No book matches '{}'".format(pattern))
+            books = [
+                book for book in books
+                if any(fnmatch(book.name(), pattern) for pattern in patterns)
+            ]
+        if self._shard:
+            shard_books = self.shard_books()
+            books = [book for book in books if book in shard_books]
+        return books
+
+    def shard_books(self):
+        """The books assigned to the shard given with --shard,
+        balanced by the number of books or by the build times recorded
+        in the library site's build manifest, according to the
+        'shard_balance' configuration option (see assign_shards()).
+        """
+        index, count = self._shard
+        costs = None
+        if self.config('shard_balance') == 'cost':
+            manifest = read_json(os.path.join(
+                self.library_site_directory(), STATE_DIR, 'build-manifest.json'
+            ))
+            costs = {
+                name: entry['build_time']
+                for name, entry in manifest.items()
+                if entry.get('build_time')
+            }
+        return assign_shards(self.books(), count, costs)[index - 1]
+
+    def shared_assets_dir(self):
+        """Directory in the site root where assets shared
+        by the books are stored (see task_dedupe_assets()).
+        """
+        return os.path.join(
+            self.site_directory(), self.config('shared_assets_dir')
+        )
+
+    def siblings_nav(self, book=None):
+        """How the other books are linked from a book's navigation:
+        - 'full': a group with a link to each book
+        - 'index': a single link to the library index page
+          (see task_library_index())
+        """
+        mode = self.config('siblings_nav', book) or 'full'
+        if mode not in ['full', 'index']:
+            raise Exception("Unknown siblings_nav option: {}".format(mode))
+        return mode
+
+    def site_directory(self):
+        """The absolute path to the generated site's root.
+        When building a shard (--shard) this is the shard's
+        output directory next to the library's site root.
+        """
+        if self._shard:
+            return shard_directory(self.library_site_directory(), *self._shard)
+        return self.library_site_directory()
+
     def site_root(self):
         """
         The relative path to the generated site's root.
@@ -318,21 +838,101 @@ in configuration file
         """
         return self.config('site_root')
 
+    def state_dir(self):
+        """
+        Directory where mkdocs-library keeps information between runs
+        (manifests, caches, copies of original search indexes).
+        It lives inside the site root and is protected from being
+        cleaned when the main book is built.
+        """
+        return os.path.join(self.site_directory(), STATE_DIR)
+
+    def state_file(self, *path):
+        """Path to a file in the state directory."""
+        return os.path.join(self.state_dir(), *path)
+
+    def stream_indexes(self):
+        """True if search indexes are read and written incrementally.
+        Set with the 'stream_indexes' configuration option
+        or the --stream-indexes command line argument.
+        """
+        return bool(self._stream_indexes or self.config('stream_indexes'))
+
     #################################################
     # High-level implementation of the various tasks.
 
-    def task_build_site(self):
+    def task_build_site(self, candidates=None):
         """Build the site
+        Books are skipped when they have an output directory and their
+        input hash (see AbstractBook.input_hash()) matches the one recorded
+        in the build manifest, unless --force is given.
+        If 'candidates' is given only these books are considered at all,
+        otherwise the books selected with --books (see selected_books()).
         Start with the main book because this clears the total site.
+        The sub books are then built with up to build_jobs()
+        MkDocs processes running in parallel.
         """
-        books_ordered = [book for book in self.books()]
+        if candidates is None:
+            candidates = self.selected_books()
+        manifest_file = self.state_file('build-manifest.json')
+        manifest = read_json(manifest_file)
         parent = self.main_book()
-        if parent:
-            books_ordered.insert(
-                0,
-                books_ordered.pop(books_ordered.index(parent)))
-        for book in books_ordered:
-            book.build()
+        try:
+            if parent in candidates:
+                self.build_book(parent, manifest)
+            self.build_books(
+                [book for book in candidates if book != parent],
+                manifest
+            )
+        finally:
+            # Record all books that have successfully been built,
+            # even if building other books failed.
+            write_json(manifest_file, manifest)
+
+    def task_compress(self):
+        """Write precompressed .gz (and .br, if the brotli module is
+        available) sidecars for the text files in the generated site,
+        for web servers that can serve precompressed files.
+        Only files that have changed since the last run are compressed.
+        """
+        print("Compressing site")
+        stats = compress_site(
+            self.site_directory(),
+            self.state_file('compress-cache.json'),
+            self.config('precompress_extensions'),
+            exclude=[self.state_dir()],
+            jobs=self._jobs
+        )
+        print("{files} files, {compressed} compressed, {unchanged} unchanged".format(
+            **stats
+        ))
+        for ext, saved in stats['saved'].items():
+            print("  .{}: {} bytes saved".format(ext, saved))
+        print("\n=======\n")
+
+    def task_dedupe_assets(self):
+        """Deduplicate assets (e.g. the theme's CSS, JavaScript
+        and fonts) that are identical in several books,
+        according to the 'dedupe_assets' configuration option
+        (defaulting to hardlinks if it isn't set).
+        """
+        mode = self.config('dedupe_assets') or 'hardlink'
+        print("Deduplicating assets ({})".format(mode))
+        stats = dedupe_site(
+            self.site_directory(),
+            [book.site_root() for book in self.books()],
+            self.state_file('dedupe-cache.json'),
+            self.config('dedupe_extensions'),
+            mode=mode,
+            shared_dir=self.shared_assets_dir(),
+            exclude=[self.state_dir()],
+            jobs=self._jobs
+        )
+        print(
+            "{files} duplicate files in {groups} groups, {bytes} bytes "
+            "deduplicated ({new} files newly deduplicated)".format(**stats)
+        )
+        print("\n=======\n")
 
     def task_deploy(self):
         """Deploy the site using a user/project-provided script.
@@ -341,47 +941,295 @@ in configuration file
         the project root or as an absolute path.
         The script has to be executable, and it has to work without
         user interaction.
+        If 'deploy_target' is configured the site is first synchronized
+        incrementally to that directory (see deploy.py), and the script
+        is only run if it exists. The changes passed to the script are
+        kept (and extended by later runs) until the script succeeds.
         """
         print("Deploying site")
-        script = self.config('deploy_script')
-        if not os.path.isabs(script):
-            script = os.path.join(self.root(), script)
-        p = Popen([script], shell=True)
-        p.wait()
-        output, errors = p.communicate()
-        print(output)
-        if errors:
-            raise Exception(errors)
+        target = self.config('deploy_target')
+        if not target:
+            self.run_deploy_script()
+            print("\n=======\n")
+            return
+
+        if not os.path.isabs(target):
+            target = os.path.join(self.root(), target)
+        target = os.path.normpath(target)
+        changes_file = self.state_file('deploy-changes.json')
+        run_script = os.path.exists(self.deploy_script())
+        stats = sync_site(
+            self.site_directory(),
+            target,
+            self.state_file('deploy-manifest.json'),
+            changes_file,
+            exclude=[self.state_dir()],
+            hardlink=self.config('deploy_hardlinks'),
+            keep_pending=run_script,
+            jobs=self._jobs
+        )
+        print("Deployed to {}".format(target))
+        print(
+            "{transferred} files transferred ({transferred_bytes} bytes), "
+            "{skipped} unchanged ({skipped_bytes} bytes skipped), "
+            "{removed} removed".format(**stats)
+        )
+        if run_script:
+            env = dict(os.environ)
+            env['MKDOCS_LIBRARY_DEPLOY_CHANGES'] = changes_file
+            self.run_deploy_script(env)
+            # The changes have been handled
+            write_json(changes_file, {'added': [], 'changed': [], 'removed': []})
         print("\n=======\n")
 
+    def task_gather(self):
+        """Assemble the output of the shards (built with --shard i/n,
+        possibly on other machines, in the directories next to the site
+        root, see site_directory()) into the site.
+        Each book's output and its original search index are taken from
+        the shard that has built it, unless the book is unchanged since
+        it was last gathered. Books that no shard has built are kept.
+        The shards' build times are recorded in the site's build manifest
+        (used with shard_balance: 'cost').
+        """
+        if self._shard:
+            raise Exception("The 'gather' recipe can't be used with --shard")
+        site_dir = self.site_directory()
+        shards = find_shards(site_dir)
+        print("Gathering the output of {} shards".format(len(shards)))
+        sources = {}
+        shard_manifests = {}
+        for directory in shards:
+            info = read_json(os.path.join(directory, STATE_DIR, SHARD_INFO_FILE))
+            shard_manifests[directory] = read_json(
+                os.path.join(directory, STATE_DIR, 'build-manifest.json')
+            )
+            for name in info.get('books', []):
+                if name in sources:
+                    raise Exception(
+                        "Book '{}' has been built by several shards "
+                        "({} and {})".format(name, sources[name], directory)
+                    )
+                sources[name] = directory
+
+        manifest_file = self.state_file('build-manifest.json')
+        manifest = read_json(manifest_file)
+        # Entries of the site root that don't belong to the main book
+        other_entries = set(
+            [STATE_DIR, os.path.basename(self.shared_assets_dir()),
+             SIBLINGS_PAGE, SIBLINGS_JSON]
+            + [book.site_segment() for book in self.books()
+               if not book.is_main_book()]
+        )
+        gathered = []
+        for book in [b for b in self.books() if b.name() in sources]:
+            directory = sources[book.name()]
+            entry = shard_manifests[directory].get(book.name())
+            if (
+                entry
+                and manifest.get(book.name(), {}).get('hash') == entry['hash']
+                and os.path.exists(os.path.join(book.site_root(), 'index.html'))
+            ):
+                continue
+            if book.is_main_book():
+                replace_entries(
+                    directory, site_dir,
+                    entries=[
+                        name for name in os.listdir(directory)
+                        if not name in other_entries
+                    ],
+                    remove=[
+                        name for name in (
+                            os.listdir(site_dir) if os.path.isdir(site_dir) else []
+                        )
+                        if not name in other_entries
+                    ]
+                )
+            else:
+                replace_entries(
+                    directory, site_dir,
+                    entries=[book.site_segment()],
+                    remove=[book.site_segment()]
+                )
+            original = book.original_index_file()
+            shard_original = os.path.join(
+                directory, STATE_DIR,
+                os.path.relpath(original, self.state_dir())
+            )
+            if os.path.exists(shard_original):
+                os.makedirs(os.path.dirname(original), exist_ok=True)
+                shutil.copy2(shard_original, original)
+            elif os.path.exists(original):
+                os.remove(original)
+            book.reset_search_index()
+            if entry:
+                manifest[book.name()] = entry
+            gathered.append(book.name())
+        write_json(manifest_file, manifest)
+        print("{} books gathered, {} unchanged".format(
+            len(gathered), len(sources) - len(gathered)
+        ))
+        missing = [
+            book.name() for book in self.books()
+            if not book.name() in sources
+            and not os.path.isdir(book.site_root())
+        ]
+        if missing:
+            print("WARNING: No output for book(s): {}".format(', '.join(missing)))
+        print("\n=======\n")
+
+    def task_library_index(self):
+        """Write the library index (a page and a JSON file listing
+        all books) to the site root, which is linked from the books'
+        navigation instead of the individual books with the
+        siblings_nav: 'index' option.
+        """
+        written = write_sibling_index(
+            self.site_directory(),
+            self.config('siblings_link_title'),
+            [
+                (
+                    book.name(),
+                    book.link_text(),
+                    '{}index.html'.format(
+                        '' if book.is_main_book() else book.site_segment() + '/'
+                    )
+                )
+                for book in self.books()
+            ]
+        )
+        print("Library index: {}".format(
+            "updated" if written else "unchanged"
+        ))
+
     def task_merge_indexes(self):
         """Merge search indexes
         MkDocs produces a search index in a JSON file, pointing to
         all documents with links relative to the site's root directory.
-        This task enhances these indexes by the indexes of all other books.
+        This task enhances these indexes by the indexes of all other books,
+        or merges them into one library index or a set of shards,
+        depending on the index mode (see index_mode()).
+        With --books only the selected books' indexes are extended
+        (in the 'per-book' mode), the other modes always process the
+        whole library as their output is shared by all books.
         """
         books = self.books()
-        # The index objects are initially created in this list comprehension
+        jobs = self.merge_jobs()
+        # Books that haven't been built (yet) can't be merged
+        missing = [
+            book for book in books if not os.path.exists(book.index_file())
+        ]
+        if missing:
+            print("WARNING: Skipping books without a search index "
+                  "(not built yet?):\n  {}".format("\n  ".join(
+                      "{}: {}".format(book.name(), book.index_file())
+                      for book in missing
+                  )))
+            books = [book for book in books if not book in missing]
+            if not books:
+                return
+        # Make sure the original indexes are preserved before any
+        # index in the site is overwritten (e.g. if the books
+        # have not been built by mkdocs-library).
+        refresh_original_indexes(self, books)
+        # The index objects are created here but only read and parsed
+        # when needed (in the 'per-book' mode possibly not at all)
         indexes = [book.search_index() for book in books]
-        for i in indexes:
-            # Merge in updated indexes to the other books
-            i.update(books)
-            # Update JSON file
-            i.write()
+        mode = self.index_mode()
+        # Remove files left over from a run in another mode
+        for file, file_mode in [
+            (LIBRARY_INDEX_FILE, 'combined'),
+            (SHARDS_MANIFEST_FILE, 'sharded'),
+            (SHARDS_LOADER_FILE, 'sharded'),
+            (SHARDS_DIR, 'sharded')
+        ]:
+            file = os.path.join(self.site_directory(), file)
+            if mode == file_mode:
+                continue
+            if os.path.isdir(file):
+                shutil.rmtree(file)
+            elif os.path.exists(file):
+                os.remove(file)
+        prebuild = self.config('rebuild_prebuilt_index')
+        if mode == 'per-book':
+            selected = self.selected_books()
+            result = write_merged_indexes(
+                self, indexes, jobs, prebuild,
+                targets=[i for i in indexes if i.book() in selected]
+            )
+            record_written_indexes(self, indexes)
+            print("Search indexes: {merge} merged, {patch} patched, "
+                  "{unchanged} unchanged".format(**result))
+            exceeded = check_index_budgets(self, indexes)
+            if self._index_report or exceeded:
+                print_index_report(self, indexes)
+            if exceeded:
+                message = "Search index budget exceeded:\n  {}".format(
+                    "\n  ".join(
+                        "{}: {} bytes (budget {})".format(*item)
+                        for item in exceeded
+                    )
+                )
+                if self.config('search_index_budget_action') == 'fail':
+                    raise Exception(message)
+                print("WARNING: " + message)
+            return
+        # The indexes in the site are replaced in the other modes
+        manifest_file = self.state_file(INDEX_MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+        parallel_map(lambda i: i.load(), indexes, jobs)
+        if mode == 'combined':
+            write_library_index(self, indexes, jobs, prebuild)
+        else:
+            write_sharded_index(self, indexes, jobs)
+        record_written_indexes(self, indexes)
 
-    def task_merge_sources(self):
+    def task_merge_sources(self, books=None):
         """Preprocess the sources.
         Process templates and navigation files
-        for each book.
+        for each book selected with --books (or the given books).
+        Books whose inputs (see AbstractBook.source_hash()) and
+        generated mkdocs.yml file are unchanged since the last run
+        are skipped, unless --force is given.
         """
-        for book in self.books():
-            # fill in values for template fields
-            book.update_template()
-            # Generate local navigation and
-            # add links to other book parts
-            self.update_nav(book)
-            # write the book's mkdocs.yml file
-            book.write_yaml()
+        manifest = read_json(self.state_file('sources-manifest.json'))
+        results = [
+            self.merge_book_sources(book, manifest)
+            for book in (self.selected_books() if books is None else books)
+        ]
+        self.write_sources_manifest(manifest, results)
+
+    def task_revision_dates(self):
+        """Read the date of the last commit of all files in the project
+        with a single 'git log' call and write them to a cache file,
+        from which the bundled 'library-revision-date' plugin reads
+        them while the books are built (see revisions.py).
+        """
+        print("Reading git revision dates")
+        stats = write_revision_dates(
+            self.root(), self.state_file(REVISION_DATES_FILE)
+        )
+        if stats['error']:
+            print("WARNING: {}".format(stats['error']))
+        elif stats['updated']:
+            print("{} files".format(stats['files']))
+        else:
+            print("{} files (unchanged since the last run)".format(
+                stats['files']
+            ))
+        print("\n=======\n")
+
+    def task_serve(self):
+        """Serve the site locally and keep it up to date.
+        The site is built, served over HTTP and rebuilt
+        whenever sources or configuration files change.
+        See LibraryServer for how changes are handled.
+        """
+        LibraryServer(
+            self,
+            self._serve_address or self.config('serve_address')
+        ).serve()
 
     # High-level implementation of the various tasks.
     #################################################
@@ -391,6 +1239,8 @@ in configuration file
         This is basically a mkdocs.yml file wtihout the nav: element
         where <<<name>>> template fields can be replaced with values
         from defaults or a book-config.yml file.
+        The template is compiled once (see template.Template)
+        and filled in for each book.
         """
         return self._template
 
@@ -424,16 +1274,25 @@ in configuration file
         # Create a group of links to the sibling books.
         # The link to the main book is integrated
         # if it is not added standalone.
-        sibling_nav = {
-            self.config('siblings_link_title'): [
-                self.book_nav(book, b)
-                for b in self.books()
-                if not (
-                    b == self.main_book()
-                    and self.config('link_to_library', book)
+        # With siblings_nav: 'index' a single link to the
+        # library index page is used instead.
+        if self.siblings_nav(book) == 'index':
+            sibling_nav = {
+                self.config('siblings_link_title'): '{}{}'.format(
+                    '' if book.is_main_book() else '../', SIBLINGS_PAGE
                 )
-            ]
-        }
+            }
+        else:
+            sibling_nav = {
+                self.config('siblings_link_title'): [
+                    self.book_nav(book, b)
+                    for b in self.books()
+                    if not (
+                        b == self.main_book()
+                        and self.config('link_to_library', book)
+                    )
+                ]
+            }
 
         def insert_nav(nav_branch):
             """
@@ -459,3 +1318,49 @@ in configuration file
                     insert_nav(entry)
         else:
             insert_nav(nav)
+
+    def uses_library_index(self):
+        """True if any book links to the library index
+        (see siblings_nav()).
+        """
+        return any(self.siblings_nav(book) == 'index' for book in self.books())
+
+    def write_shard_info(self, build_nodes):
+        """Record the books the shard has built (or skipped because
+        they are unchanged) for task_gather(). Books built in a previous
+        run of the shard are kept as long as they are still assigned
+        to the shard and haven't failed now.
+        """
+        index, count = self._shard
+        info_file = self.state_file(SHARD_INFO_FILE)
+        info = read_json(info_file)
+        names = set()
+        if info.get('count') == count and info.get('index') == index:
+            names.update(info.get('books', []))
+        for book, node in build_nodes.items():
+            if node.state() == 'done':
+                names.add(book.name())
+            else:
+                names.discard(book.name())
+        write_json(info_file, {
+            'index': index,
+            'count': count,
+            'books': [
+                book.name() for book in self.shard_books()
+                if book.name() in names
+            ]
+        })
+
+    def write_sources_manifest(self, manifest, results):
+        """Write the manifest updated by merge_book_sources()
+        and print a summary of its results.
+        """
+        names = [book.name() for book in self.books()]
+        write_json(self.state_file('sources-manifest.json'), {
+            name: entry for name, entry in manifest.items() if name in names
+        })
+        print("mkdocs.yml files: {} regenerated ({} changed), {} reused".format(
+            len([r for r in results if r != 'reused']),
+            results.count('written'),
+            results.count('reused')
+        ))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Collect the git revision dates of all files in a single pass
+"""
+
+from subprocess import DEVNULL, CalledProcessError, check_output
+
+from .util import read_json, write_json
+
+
+# Cache of the revision dates (relative to the project's state directory)
+REVISION_DATES_FILE = 'revision-dates.json'
+
+# Name of the plugin replaced by the bundled plugin (see plugin.py)
+GIT_REVISION_PLUGIN = 'git-revision-date-localized'
+
+# Name of the bundled plugin (entry point in setup.py)
+LIBRARY_REVISION_PLUGIN = 'library-revision-date'
+
+# Options of the replaced plugin supported by the bundled plugin
+SUPPORTED_OPTIONS = ['type', 'locale']
+
+
+def _git(directory, *args):
+    """Run a git command in directory and return its output."""
+    return check_output(
+        ['git', '-c', 'core.quotePath=false'] + list(args),
+        cwd=directory,
+        stderr=DEVNULL,
+        universal_newlines=True
+    )
+
+
+def read_revision_dates(directory):
+    """Return the timestamp (author date) of the last commit
+    of each file below directory, as a dictionary with paths
+    relative to the repository's top-level directory.
+    This is read with a single 'git log' call.
+    """
+    dates = {}
+    timestamp = None
+    output = _git(
+        directory, 'log', '--format=%x00%at', '--name-only', '--no-renames',
+        '--', '.'
+    )
+    for line in output.splitlines():
+        if line.startswith('\x00'):
+            timestamp = int(line[1:])
+        elif line and not line in dates:
+            # The log starts with the newest commit
+            dates[line] = timestamp
+    return dates
+
+
+def write_revision_dates(directory, cache_file):
+    """Write the revision dates of the files below directory
+    (see read_revision_dates()) to cache_file, together with the
+    repository's top-level directory. If HEAD hasn't changed since
+    the cache file has been written it is kept as it is.
+    Returns a dictionary with the number of files, whether the
+    cache has been updated, and an error message if the dates
+    can't be read (e.g. if directory isn't in a git repository).
+    """
+    try:
+        root, head = _git(
+            directory, 'rev-parse', '--show-toplevel', 'HEAD'
+        ).splitlines()
+    except (OSError, CalledProcessError, ValueError):
+        write_json(cache_file, {'root': None, 'head': None, 'dates': {}})
+        return {
+            'files': 0,
+            'updated': False,
+            'error': "{} is not in a git repository (with commits)".format(
+                directory
+            )
+        }
+    cache = read_json(cache_file)
+    if cache.get('root') == root and cache.get('head') == head:
+        return {'files': len(cache['dates']), 'updated': False, 'error': None}
+    dates = read_revision_dates(directory)
+    write_json(cache_file, {'root': root, 'head': head, 'dates': dates})
+    return {'files': len(dates), 'updated': True, 'error': None}
+
+
+def replace_revision_plugin(plugins, cache_file):
+    """Return a copy of a 'plugins' configuration where the
+    git-revision-date-localized plugin is replaced by the bundled
+    plugin reading the dates from cache_file (the supported
+    options are passed on, see SUPPORTED_OPTIONS).
+    """
+    result = []
+    for plugin in plugins or []:
+        if plugin == GIT_REVISION_PLUGIN:
+            options = {}
+        elif isinstance(plugin, dict) and GIT_REVISION_PLUGIN in plugin:
+            options = {
+                key: value
+                for key, value in (plugin[GIT_REVISION_PLUGIN] or {}).items()
+                if key in SUPPORTED_OPTIONS
+            }
+        else:
+            result.append(plugin)
+            continue
+        options['cache_file'] = cache_file
+        result.append({LIBRARY_REVISION_PLUGIN: options})
+    return result
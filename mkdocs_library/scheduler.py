@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Run the steps of a recipe as a dependency graph
+"""
+
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .profiling import NullProfiler
+
+
+class Node(object):
+    """
+    A step in a recipe, either for a single book
+    (e.g. building it) or global (e.g. merging the indexes).
+    """
+
+    def __init__(self, name, func, deps, book=None, inline=False):
+        self._name = name
+        self._inline = inline
+        self._func = func
+        self._deps = list(deps)
+        self._book = book
+        self._start = None
+        self._end = None
+        # 'pending', 'done', 'failed' or 'skipped'
+        self._state = 'pending'
+
+    def book(self):
+        return self._book
+
+    def deps(self):
+        return self._deps
+
+    def duration(self):
+        """Wall time of the node, 0 if it hasn't been run."""
+        if self._end is None:
+            return 0
+        return self._end - self._start
+
+    def inline(self):
+        """True if the node is run in the scheduler's own thread."""
+        return self._inline
+
+    def label(self):
+        """The name, with the book in parentheses (if any)."""
+        if self._book:
+            return '{}({})'.format(self._name, self._book.name())
+        return self._name
+
+    def name(self):
+        return self._name
+
+    def run(self, profiler):
+        self._start = time.perf_counter()
+        try:
+            with profiler.span(self._name, self._book, category='node'):
+                self._func()
+        finally:
+            self._end = time.perf_counter()
+
+    def state(self):
+        return self._state
+
+
+class Scheduler(object):
+    """
+    Runs nodes as soon as all nodes they depend on are done,
+    with at most 'jobs' nodes running at the same time.
+    If a node fails the nodes depending on it are skipped,
+    but all other nodes are still run. The first error
+    is raised after all possible nodes have run.
+    Nodes have to be added after the nodes they depend on,
+    and nodes that are ready at the same time are started
+    in the order they have been added.
+    'Inline' nodes are run in the calling thread once no other
+    node is running (e.g. the 'serve' task, which has to be
+    interruptible with Ctrl-C).
+    """
+
+    def __init__(self, jobs=1, profiler=None):
+        self._jobs = max(1, jobs)
+        self._profiler = profiler or NullProfiler()
+        self._nodes = []
+
+    def add(self, name, func, deps=(), book=None, inline=False):
+        """Add a node calling func() and return it."""
+        node = Node(name, func, deps, book, inline)
+        self._nodes.append(node)
+        return node
+
+    def critical_path(self):
+        """Return the chain of nodes with the longest total duration
+        (the path that determined the duration of the whole run)
+        and its duration.
+        """
+        cost = {}
+        previous = {}
+        for node in self._nodes:
+            best = max(node.deps(), key=lambda d: cost[d], default=None)
+            cost[node] = node.duration() + (cost[best] if best else 0)
+            previous[node] = best
+        if not self._nodes:
+            return [], 0
+        node = max(self._nodes, key=lambda n: cost[n])
+        total = cost[node]
+        path = []
+        while node:
+            path.append(node)
+            node = previous[node]
+        return list(reversed(path)), total
+
+    def nodes(self):
+        return self._nodes
+
+    def print_critical_path(self):
+        path, total = self.critical_path()
+        print("Critical path ({:.2f}s):".format(total))
+        for node in path:
+            print("  {:<40} {:>8.2f}s".format(node.label(), node.duration()))
+
+    def _run_inline(self, node, errors):
+        try:
+            node.run(self._profiler)
+            node._state = 'done'
+        except Exception as e:
+            node._state = 'failed'
+            errors.append((node, e))
+
+    def run(self):
+        """Run all nodes, see the class documentation."""
+        pending = list(self._nodes)
+        running = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            while pending or running:
+                for node in list(pending):
+                    states = [dep.state() for dep in node.deps()]
+                    if any(state in ['failed', 'skipped'] for state in states):
+                        node._state = 'skipped'
+                        pending.remove(node)
+                    elif all(state == 'done' for state in states):
+                        if node.inline():
+                            if running:
+                                break
+                            pending.remove(node)
+                            self._run_inline(node, errors)
+                            continue
+                        if len(running) >= self._jobs:
+                            break
+                        pending.remove(node)
+                        running[executor.submit(node.run, self._profiler)] = node
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    try:
+                        future.result()
+                        node._state = 'done'
+                    except Exception as e:
+                        node._state = 'failed'
+                        errors.append((node, e))
+        if errors:
+            if len(errors) > 1:
+                raise Exception(
+                    "The following step(s) failed:\n  {}".format(
+                        "\n  ".join(node.label() for node, _ in errors)
+                    )
+                )
+            raise errors[0][1]
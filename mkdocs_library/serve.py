@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Serve the generated site locally and rebuild it when sources change
+"""
+
+import os
+import threading
+import time
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """Request handler that doesn't log every request."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LibraryServer(object):
+    """
+    Watches a project's sources and configuration, serves the site
+    over HTTP and does the least possible work for each change:
+    - changes in a book's docs rebuild only that book
+    - changes in a book's navigation merge the sources of
+      and rebuild only that book
+    - changes in a book's configuration do the same, unless the
+      book's link text has changed, which affects all books
+    - changes in the project configuration (template, defaults,
+      config, outline) or to the list of books rebuild everything
+    After rebuilding, the search indexes are merged again, re-reading
+    only the indexes of the rebuilt books.
+    Changes arriving in bursts are collected until the sources have
+    been quiet for the debounce interval.
+    """
+
+    def __init__(self, project, address, interval=0.5, debounce=0.5):
+        self._project = project
+        host, _, port = address.rpartition(':')
+        self._address = (host or 'localhost', int(port))
+        self._interval = interval
+        self._debounce = debounce
+        self._snapshot = self.snapshot()
+
+    def changed_files(self):
+        """Return the files that have been added, modified or
+        removed since the last call, and update the snapshot.
+        """
+        snapshot = self.snapshot()
+        changed = set(
+            file for file in set(snapshot) | set(self._snapshot)
+            if snapshot.get(file) != self._snapshot.get(file)
+        )
+        self._snapshot = snapshot
+        return changed
+
+    def project(self):
+        return self._project
+
+    def rebuild(self, files):
+        """Map the changed files to the affected books and rebuild them."""
+        project = self.project()
+        books = {book.name(): book for book in project.books()}
+        books_dir = os.path.join(project.root(), 'books')
+        full = False
+        merge = set()
+        build = set()
+        for file in files:
+            parts = os.path.relpath(file, books_dir).split(os.sep)
+            if parts[0] == '..' or len(parts) < 3 or not parts[0] in books:
+                # Project configuration or new/removed book
+                full = True
+                break
+            book = books[parts[0]]
+            if parts[1] == 'docs':
+                build.add(book)
+            elif parts[1] == '_config':
+                if parts[2] == 'book-config.yml':
+                    link_text = book.link_text()
+                    book.load_config()
+                    if book.link_text() != link_text:
+                        # The sibling navigation of all books changes
+                        full = True
+                        break
+                merge.add(book)
+                build.add(book)
+
+        if full:
+            print("Rebuilding whole library")
+            self._project = project = project.reload()
+            project.task_merge_sources()
+            project.task_build_site()
+            if project.uses_library_index():
+                project.task_library_index()
+        else:
+            print("Rebuilding book(s):", ', '.join(book.name() for book in build))
+            for book in merge:
+                book.load_config()
+            project.task_merge_sources(
+                [book for book in project.books() if book in merge]
+            )
+            project.task_build_site(
+                [book for book in project.books() if book in build]
+            )
+        project.task_merge_indexes()
+
+    def serve(self):
+        """Build the site, then serve it and watch for changes
+        until interrupted with Ctrl-C.
+        """
+        project = self.project()
+        project.task_merge_sources()
+        project.task_build_site()
+        if project.uses_library_index():
+            project.task_library_index()
+        project.task_merge_indexes()
+
+        server = ThreadingHTTPServer(
+            self._address,
+            partial(_QuietHandler, directory=project.site_directory())
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print("Serving library on http://{}:{}/ (Ctrl-C to stop)".format(
+            *server.server_address[:2]
+        ))
+
+        pending = set()
+        last_change = 0
+        try:
+            while True:
+                time.sleep(self._interval)
+                changed = self.changed_files()
+                if changed:
+                    pending |= changed
+                    last_change = time.monotonic()
+                    continue
+                if pending and time.monotonic() - last_change >= self._debounce:
+                    files, pending = pending, set()
+                    try:
+                        self.rebuild(files)
+                    except Exception as e:
+                        print("ERROR:", e)
+                    # Don't react to files written while rebuilding
+                    self._snapshot = self.snapshot()
+                    print("Watching for changes")
+        except KeyboardInterrupt:
+            print("Stopping server")
+        finally:
+            server.shutdown()
+
+    def snapshot(self):
+        """Return a dictionary with modification time and size
+        of all watched files: the project configuration and
+        the books' docs and configuration directories.
+        """
+        project = self.project()
+        directories = [os.path.join(project.root(), '_config')]
+        books_dir = os.path.join(project.root(), 'books')
+        if os.path.isdir(books_dir):
+            for name in os.listdir(books_dir):
+                for sub_dir in ['docs', '_config']:
+                    directories.append(os.path.join(books_dir, name, sub_dir))
+        result = {}
+        for directory in directories:
+            for root, dirs, files in os.walk(directory):
+                for file in files:
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    result[path] = (stat.st_mtime_ns, stat.st_size)
+        return result
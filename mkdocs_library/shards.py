@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Split the build of a library into shards (--shard i/n)
+and gather the shards' output into one site
+"""
+
+import glob
+import os
+import re
+import shutil
+
+
+# Information about the books a shard has built
+# (relative to the shard's state directory)
+SHARD_INFO_FILE = 'shard.json'
+
+
+def parse_shard(value):
+    """Parse the value of the --shard option ('i/n', 1 <= i <= n)
+    into an (index, count) tuple, or return None if value is empty.
+    """
+    if not value:
+        return None
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', value)
+    if not match:
+        raise Exception("Invalid --shard value (expected i/n): {}".format(value))
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise Exception("Invalid shard {}/{}".format(index, count))
+    return index, count
+
+
+def assign_shards(books, count, costs=None):
+    """Distribute the books over 'count' shards.
+    Without costs the books are assigned in turn, in library order,
+    so each shard gets the same number of books (+/- 1).
+    Otherwise 'costs' is a dictionary with the (e.g. recorded build)
+    cost of each book name, and each book, starting with the most
+    expensive ones, is assigned to the shard with the lowest total
+    cost so far. Books without a recorded cost are estimated with the
+    average cost. The result only depends on the book names and costs,
+    so each shard (e.g. on another machine) computes the same assignment.
+    Returns a list of book lists, in library order.
+    """
+    shards = [[] for _ in range(count)]
+    if costs is None:
+        for i, book in enumerate(books):
+            shards[i % count].append(book)
+        return shards
+    known = [costs[b.name()] for b in books if b.name() in costs]
+    default = sum(known) / len(known) if known else 1
+    order = {book: i for i, book in enumerate(books)}
+    loads = [0] * count
+    for book in sorted(
+        books, key=lambda b: (-costs.get(b.name(), default), order[b])
+    ):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        loads[shard] += costs.get(book.name(), default)
+        shards[shard].append(book)
+    return [sorted(shard, key=lambda b: order[b]) for shard in shards]
+
+
+def shard_directory(site_dir, index, count):
+    """The output directory of a shard, next to the site directory."""
+    return '{}-shard-{}-of-{}'.format(
+        os.path.normpath(site_dir), index, count
+    )
+
+
+def find_shards(site_dir):
+    """Return the output directories of the shards of a site,
+    ordered by shard index. Raises an Exception if the directories
+    don't form a complete set of shards.
+    """
+    found = {}
+    for directory in glob.glob(shard_directory(site_dir, '*', '*')):
+        match = re.search(r'-shard-(\d+)-of-(\d+)$', directory)
+        if match and os.path.isdir(directory):
+            found[(int(match.group(1)), int(match.group(2)))] = directory
+    counts = set(count for _, count in found)
+    if not counts:
+        raise Exception("No shard output found for {}".format(site_dir))
+    if len(counts) > 1:
+        raise Exception(
+            "Found shard output for different shard counts ({}), "
+            "please remove the outdated directories".format(
+                ', '.join(str(count) for count in sorted(counts))
+            )
+        )
+    count = counts.pop()
+    missing = [i for i in range(1, count + 1) if not (i, count) in found]
+    if missing:
+        raise Exception("Missing output of shard(s) {} of {}".format(
+            ', '.join(str(i) for i in missing), count
+        ))
+    return [found[(i, count)] for i in range(1, count + 1)]
+
+
+def _link_or_copy(source, target):
+    """Hardlink a file (fast if the shards are on the same
+    file system as the site), or copy it if that isn't possible.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def replace_entries(source_dir, target_dir, entries, remove):
+    """Replace the entries (files or directories) in target_dir:
+    the entries in 'remove' are removed from target_dir first,
+    then 'entries' are copied from source_dir.
+    """
+    for name in remove:
+        path = os.path.join(target_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+    os.makedirs(target_dir, exist_ok=True)
+    for name in entries:
+        source = os.path.join(source_dir, name)
+        target = os.path.join(target_dir, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, copy_function=_link_or_copy)
+        else:
+            _link_or_copy(source, target)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Write the library index listing all books (siblings_nav: 'index')
+"""
+
+import html
+import json
+import os
+
+from collections import OrderedDict
+
+
+# Locations of the library index page and its JSON counterpart
+# relative to the site root
+SIBLINGS_PAGE = 'library-index.html'
+SIBLINGS_JSON = 'library-index.json'
+
+
+def _write_if_changed(file, content):
+    """Atomically write a file, unless it already has the given content
+    (so the modification time of unchanged files is kept).
+    Returns True if the file has been written.
+    """
+    if os.path.exists(file):
+        with open(file, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    temp_file = file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_file, file)
+    return True
+
+
+def write_sibling_index(site_dir, title, books):
+    """Write the library index page and JSON file to the site root.
+    'books' is a list of (name, title, url) tuples, with URLs
+    relative to the site root. The JSON file contains the same
+    information, e.g. for a theme partial rendering the books.
+    Returns the number of files that have been (re)written.
+    """
+    data = OrderedDict()
+    data['title'] = title
+    data['books'] = [
+        OrderedDict([('name', name), ('title', book_title), ('url', url)])
+        for name, book_title, url in books
+    ]
+    with open(os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        'assets',
+        'library-index.html'
+    ), 'r', encoding='utf-8') as f:
+        template = f.read()
+    page = template.format(
+        title=html.escape(title),
+        books='\n'.join(
+            '    <li><a href="{}">{}</a></li>'.format(
+                html.escape(url), html.escape(book_title)
+            )
+            for _, book_title, url in books
+        )
+    )
+    os.makedirs(site_dir, exist_ok=True)
+    return sum([
+        _write_if_changed(os.path.join(site_dir, SIBLINGS_PAGE), page),
+        _write_if_changed(
+            os.path.join(site_dir, SIBLINGS_JSON),
+            json.dumps(data, indent=2) + '\n'
+        )
+    ])
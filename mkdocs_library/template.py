@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# This file is part of the mkdocs-library project,
+# https://github.com/uliska/mkdocs-library
+# https://glarean.mh-freiburg.de/git/GLAREAN-Doku/mkdocs-library/
+#
+# Copyright \(c\) 2020 by Urs Liska
+# Developed with support of the University of Music Freiburg
+# https://mh-freiburg.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Compiled mkdocs.yml templates with <<<field>>> slots
+"""
+
+import re
+
+import oyaml
+
+# A template field, e.g. <<<repo_url>>>
+FIELD_RE = re.compile('<<<(.+?)>>>')
+
+def _typed_scalar(value):
+    """Return a plain scalar as YAML would load it
+    (e.g. 'true' as a boolean or '8' as an integer).
+    A new loader is used for each value and its constructor is called
+    directly, as construct_object() would keep every node in the
+    loader's cache (and templates are filled from several threads).
+    """
+    loader = oyaml.SafeLoader('')
+    tag = loader.resolve(oyaml.ScalarNode, value, (True, False))
+    return loader.yaml_constructors[tag](loader, oyaml.ScalarNode(tag, value))
+
+
+class _Slot(object):
+    """
+    A scalar value in the template containing one or more fields.
+    'parts' alternates between literal text and field names,
+    starting and ending with (possibly empty) literal text.
+    Plain (unquoted) scalars are typed after filling them in,
+    quoted scalars are always strings.
+    """
+
+    def __init__(self, value, plain):
+        self._parts = FIELD_RE.split(value)
+        self._plain = plain
+
+    def fields(self):
+        return self._parts[1::2]
+
+    def fill(self, values):
+        parts = self._parts
+        if self._plain and len(parts) == 3 and not parts[0] and not parts[2]:
+            # The whole value is a single field
+            value = values[parts[1]]
+            return _typed_scalar(value) if isinstance(value, str) else value
+        result = ''.join(
+            str(values[part]) if i % 2 else part
+            for i, part in enumerate(parts)
+        )
+        return _typed_scalar(result) if self._plain else result
+
+
+class _Constant(object):
+    """A (scalar) value without fields."""
+
+    def __init__(self, value):
+        self._value = value
+
+    def fill(self, values):
+        return self._value
+
+
+class _Mapping(object):
+    """A mapping with constant keys and compiled values."""
+
+    def __init__(self, items):
+        self._items = items
+
+    def fill(self, values):
+        return {key: value.fill(values) for key, value in self._items}
+
+
+class _Sequence(object):
+    """A sequence of compiled values."""
+
+    def __init__(self, items):
+        self._items = items
+
+    def fill(self, values):
+        return [item.fill(values) for item in self._items]
+
+
+class Template(object):
+    """
+    A mkdocs.yml template, parsed once into a structure of
+    mappings, sequences, constant values and slots for the
+    <<<field>>> placeholders. fill() creates a book's configuration
+    from it without parsing YAML again.
+    Fields may only be used in (scalar) values, not in keys.
+    """
+
+    def __init__(self, text, file=None):
+        self._file = file
+        self._fields = []
+        loader = oyaml.SafeLoader(text)
+        try:
+            node = loader.get_single_node()
+            self._root = (
+                self._compile(loader, node) if node else _Mapping([])
+            )
+        finally:
+            loader.dispose()
+
+    def _compile(self, loader, node):
+        """Turn a YAML node into the compiled structure."""
+        if isinstance(node, oyaml.MappingNode):
+            loader.flatten_mapping(node)
+            items = []
+            for key_node, value_node in node.value:
+                key = loader.construct_object(key_node, deep=True)
+                if isinstance(key, str) and FIELD_RE.search(key):
+                    raise Exception("""Template fields are not supported in keys:
+  {key}
+in template file
+  {file}
+            """.format(
+                        key=key,
+                        file=self._file
+                    ))
+                items.append((key, self._compile(loader, value_node)))
+            return _Mapping(items)
+        if isinstance(node, oyaml.SequenceNode):
+            return _Sequence([self._compile(loader, item) for item in node.value])
+        if (
+            node.tag == 'tag:yaml.org,2002:str'
+            and FIELD_RE.search(node.value)
+        ):
+            slot = _Slot(node.value, plain=node.style is None)
+            for field in slot.fields():
+                if not field in self._fields:
+                    self._fields.append(field)
+            return slot
+        return _Constant(loader.construct_object(node, deep=True))
+
+    def fields(self):
+        """The names of the fields in the template, in order of appearance."""
+        return self._fields
+
+    def fill(self, values):
+        """Return a new configuration dictionary with the fields
+        filled in from the 'values' dictionary.
+        """
+        return self._root.fill(values)
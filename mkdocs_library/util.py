@@ -25,10 +25,15 @@
 Common utility functions
 """
 
+import copy
+import hashlib
+import json
 import os
 import oyaml
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 # TODO: This has to become much cleaner
 def missing_file(book):
     sys.exit("""
@@ -40,20 +45,148 @@ Aborting.
     """.format(book))
 
 
+# Use libyaml's (much faster) C implementation if it is available.
+# (oyaml registers its order-preserving representers for these as well.)
+_YAMLLoader = getattr(oyaml, 'CSafeLoader', oyaml.SafeLoader)
+_YAMLDumper = getattr(oyaml, 'CSafeDumper', oyaml.SafeDumper)
+
+
+class _NoAliasDumper(_YAMLDumper):
+    """Safe dumper that never writes anchors and aliases,
+    which MkDocs configuration files shouldn't contain.
+    """
+
+    def ignore_aliases(self, data):
+        return True
+
+
+# Parsed YAML files, by path, with the modification time
+# and size they had when being read.
+_yaml_cache = {}
+
+
+def load_yaml(text):
+    """Parse a YAML string (with the safe loader)."""
+    return oyaml.load(text, Loader=_YAMLLoader)
+
+
 def read_yaml(file):
     """
     Read a YAML file and return its configuration as an ordered dictionary.
     If the file doesn't exist an empty dict is returned.
+    Parsed files are cached as long as their modification time and size
+    don't change, the caller always gets its own (deep) copy.
     """
-    if not os.path.exists(file):
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
         return {}
-    with open(file, 'r') as f:
-        return oyaml.load(f.read(), Loader=oyaml.SafeLoader) or {}
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _yaml_cache.get(file)
+    if not cached or cached[0] != key:
+        with open(file, 'r') as f:
+            cached = _yaml_cache[file] = (key, load_yaml(f.read()) or {})
+    return copy.deepcopy(cached[1])
+
 
 def serialize_yaml(yml):
     """
     Serialize a YAML dictionary to a multiline string.
     """
-    noalias_dumper = oyaml.dumper.SafeDumper
-    noalias_dumper.ignore_aliases = lambda self, data: True
-    return oyaml.dump(yml, allow_unicode=True, Dumper=noalias_dumper)
+    return oyaml.dump(yml, allow_unicode=True, Dumper=_NoAliasDumper)
+
+
+def _hashed_path(file, root):
+    """The path of a file as fed to a hash: relative to root (with
+    forward slashes), so hashes don't change when the project is moved
+    or built in another location. Files outside root (e.g. the program
+    defaults) are identified by their name only.
+    """
+    if root is None:
+        return file
+    path = os.path.relpath(file, root)
+    if path.split(os.sep)[0] == os.pardir:
+        return os.path.basename(file)
+    return path.replace(os.sep, '/')
+
+
+def hash_file(hasher, file, root=None):
+    """
+    Feed a file's path (relative to root if given) and content
+    to a hashlib object.
+    Missing files are hashed as such, so creating or removing
+    a file changes the hash as well.
+    """
+    hasher.update(_hashed_path(file, root).encode('utf-8'))
+    if os.path.isfile(file):
+        with open(file, 'rb') as f:
+            hasher.update(f.read())
+    else:
+        hasher.update(b'<missing>')
+
+
+def file_digest(file, root=None):
+    """Return the hex digest of hash_file() for a single file."""
+    hasher = new_hash()
+    hash_file(hasher, file, root)
+    return hasher.hexdigest()
+
+
+def content_digest(file):
+    """Return the hex digest of a file's content (read in chunks)."""
+    hasher = new_hash()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_tree(hasher, directory, root=None):
+    """
+    Feed all files below a directory to a hashlib object,
+    in a stable (sorted) order, with paths relative to root if given.
+    """
+    for current, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            hash_file(hasher, os.path.join(current, file), root)
+
+
+def new_hash():
+    """Return a new hashlib object of the type used for content hashes."""
+    return hashlib.sha1()
+
+
+def parallel_map(func, items, jobs=1):
+    """
+    Apply func to all items and return the results as a list, in order.
+    With more than one job this is done in a thread pool.
+    """
+    if jobs <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(func, items))
+
+
+def read_json(file):
+    """
+    Read a JSON file and return its content.
+    If the file doesn't exist an empty dict is returned.
+    """
+    if not os.path.exists(file):
+        return {}
+    with open(file, 'r') as f:
+        return json.load(f)
+
+
+def write_json(file, data):
+    """
+    Write data to a JSON file, creating the directory if necessary.
+    The file is replaced atomically so an interrupted run never
+    leaves a truncated file behind.
+    """
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    temp_file = file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temp_file, file)
@@ -15,9 +15,16 @@ setup(
         'mkdocs>=1.1',
         'oyaml',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'lunr': ['lunr'],
+    },
     entry_points={
         "console_scripts": [
             "mkdocs-library = mkdocs_library.main:main",
         ],
+        "mkdocs.plugins": [
+            "library-revision-date = mkdocs_library.plugin:RevisionDatePlugin",
+        ],
     },
 )